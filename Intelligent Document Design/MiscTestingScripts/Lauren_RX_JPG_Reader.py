@@ -2,8 +2,17 @@ import os
 import boto3
 import json
 import re
+import sys
+import time
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedCode.ndjson_sink import RotatingNDJSONSink
+
+# Results are appended to rotating jpg_extracted_info-*.ndjson files in this folder (set COMPRESS_RESULTS for .ndjson.zst)
+RESULTS_DIR = "extracted_results"
+COMPRESS_RESULTS = False
+
 # Load environment variables from .env
 load_dotenv()
 
@@ -111,7 +120,12 @@ if __name__ == "__main__":
         json_output = json.dumps(data, indent=4)
         print(f"\nExtracted Data:\n{json_output}")
 
-        with open("jpg_extracted_info.json", "w") as f:
-            f.write(json_output)
+        # Append to the results stream instead of overwriting jpg_extracted_info.json on every run
+        with RotatingNDJSONSink(RESULTS_DIR, "jpg_extracted_info", compress=COMPRESS_RESULTS) as results:
+            results.add({
+                "object_key": object_key,
+                "extracted_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "data": data
+            })
     else:
         print("Textract failed to process the image.")
@@ -3,13 +3,25 @@ import boto3
 import json
 import time
 import re
-import PyPDF2
-from io import BytesIO
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedCode.document_object import DocumentObject
+from sharedCode.kv_resolution import resolve_kv_map
+from sharedCode.layout_heuristics import detect_signature
+from sharedCode.ndjson_sink import RotatingNDJSONSink
+from sharedCode.pdf_text import iter_pdf_page_text, join_pdf_page_text
+from sharedCode.text_matching import KeywordSet, KeywordScorer, PatternMatcher
+
 # =============== CONFIGURATION ===============
 # Set entity tag here for easy changing
 ENTITY_TAG = "bf3f6699401b86622f17161754d168e5" # Replace with the desired entity tag
+# PDF text backend: "pymupdf", "pypdf2", or None for PDF_TEXT_BACKEND in .env / the fastest one installed
+PDF_TEXT_BACKEND = None
+# Results are appended to rotating extracted_info-*.ndjson files in this folder (set COMPRESS_RESULTS for .ndjson.zst)
+RESULTS_DIR = "extracted_results"
+COMPRESS_RESULTS = False
 # ============================================
 
 # Load environment variables
@@ -61,24 +73,16 @@ def get_s3_bucket_object_by_tag(bucket, entity_tag):
                     print(f"Error fetching metadata for {object_key}: {e}")
     return None
 
+def iter_pdf_pages(bucket, object_key):
+    """Yield the text of each PDF page lazily, so callers can stop after the first few pages"""
+    # Stream the PDF from S3 into a spooled file and parse it in place, without copying it into bytes
+    with DocumentObject(s3, bucket, object_key) as document:
+        yield from iter_pdf_page_text(document.open(), PDF_TEXT_BACKEND)
+
 def extract_text_from_pdf(bucket, object_key):
-    """Extract text directly from PDF using PyPDF2"""
+    """Extract the PDF's text layer with the configured backend (PDF_TEXT_BACKEND, PyMuPDF by default)"""
     try:
-        # Download the PDF file from S3
-        response = s3.get_object(Bucket=bucket, Key=object_key)
-        pdf_content = response['Body'].read()
-        
-        # Process the PDF
-        pdf_file = BytesIO(pdf_content)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        
-        # Extract text from all pages
-        all_text = ""
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            all_text += page.extract_text() + "\n\n"
-        
-        return all_text
+        return join_pdf_page_text(iter_pdf_pages(bucket, object_key))
     except Exception as e:
         print(f"Error extracting text from PDF: {e}")
         return None
@@ -155,57 +159,43 @@ def structure_text(response):
 
     return sections, text
 
+# Keyword lists and patterns are compiled once at import and shared by every document
+PATIENT_KEY_TERMS = KeywordSet(["mother", "infant", "patient", "name", "dob", "date of birth", "phone"])
+DOCTOR_KEY_TERMS = KeywordSet(["physician", "doctor", "md", "prescribing"])
+PUMP_TERMS = KeywordSet(["breast pump", "double electric", "double-electric", "electric breast pump"])
+
+# Common patterns for patient details, as (field name, regex)
+PATIENT_FIELD_PATTERNS = PatternMatcher([
+    ("Patient Name", r"(?:Mother|Patient)\s*Name[:\s]+([^:\n]+)"),
+    ("Date of Birth", r"(?:Mother|Patient)?\s*Date of [Bb]irth[:\s]+([^:\n]+)"),
+    ("DOB", r"(?:Mother|Patient)?\s*DOB[:\s]+([^:\n]+)"),
+    ("Phone Number", r"(?:Mother|Patient)?\s*Phone\s*(?:Number)?[:\s]+([^:\n]+)"),
+    ("Infant Name", r"(?:Infant|Baby)\s*Name[:\s]+([^:\n]+)"),
+    ("Infant Date of Birth", r"(?:Infant|Baby)\s*Date of [Bb]irth[:\s]+([^:\n]+)"),
+    ("EDD", r"EDD[:\s]+([^:\n]+)")
+])
+
+AGREEMENT_DATE_PATTERNS = PatternMatcher([
+    ("Date", r"Date\s*:\s*(\d{2}/\d{2}/\d{4})"),
+    ("Date", r"Fecha\s*:\s*(\d{2}/\d{2}/\d{4})"),
+    ("Date", r"(\d{2}/\d{2}/\d{4})")
+])
+
+AGREEMENT_NAME_PATTERNS = PatternMatcher([
+    ("Name", r"Signed by customer\s*:\s*([^\n\.;,]+)"),
+    ("Name", r"Signed by\s*:\s*([^\n\.;,]+)"),
+    ("Name", r"Customer\s*:\s*([^\n\.;,]+)")
+])
+
 def extract_information_medical(response, pdf_text=None):
     patient_info = {}
     doctor_info = {}
     prescription_info = {}
 
-    key_map = {}
-    value_map = {}
-    block_map = {}
-
     blocks = response.get('Blocks', [])
     if not blocks:
         raise ValueError("No blocks found in Textract response")
 
-    # Create block maps for KV processing
-    for block in blocks:
-        block_id = block['Id']
-        block_map[block_id] = block
-        if block['BlockType'] == "KEY_VALUE_SET":
-            if 'KEY' in block['EntityTypes']:
-                key_map[block_id] = block
-            else:
-                value_map[block_id] = block
-
-    def get_kv_relationship(key_map, value_map, block_map):
-        kvs = {}
-        for block_id, key_block in key_map.items():
-            value_block = None
-            for relationship in key_block.get('Relationships', []):
-                if relationship['Type'] == 'VALUE':
-                    for value_id in relationship['Ids']:
-                        value_block = value_map.get(value_id)
-                        break
-            key = get_text(key_block, block_map)
-            value = get_text(value_block, block_map)
-            kvs[key] = value
-        return kvs
-
-    def get_text(result, blocks_map):
-        text = ''
-        if result and 'Relationships' in result:
-            for relationship in result['Relationships']:
-                if relationship['Type'] == 'CHILD':
-                    for child_id in relationship['Ids']:
-                        word = blocks_map[child_id]
-                        if word['BlockType'] == 'WORD':
-                            text += word['Text'] + ' '
-                        if word['BlockType'] == 'SELECTION_ELEMENT':
-                            if word['SelectionStatus'] == 'SELECTED':
-                                text += 'X '
-        return text.strip()
-
     # Extract text from all LINE blocks to help with pattern matching
     all_lines = []
     for block in blocks:
@@ -213,13 +203,13 @@ def extract_information_medical(response, pdf_text=None):
             all_lines.append(block['Text'])
     all_text = "\n".join(all_lines)
 
-    # Use PyPDF2 extracted text if available (helpful for certain PDF formats)
+    # Use the PDF's own text layer if available (helpful for certain PDF formats)
     if pdf_text:
-        print("Using PyPDF2 extracted text for additional analysis")
+        print("Using PDF text layer for additional analysis")
         all_text += "\n" + pdf_text
 
     # Get Key-Value pairs
-    kvs = get_kv_relationship(key_map, value_map, block_map)
+    kvs = resolve_kv_map(blocks)
 
     # Check for document format - Texas Children's Hospital or Breast Pump Depot
     is_texas_childrens = "Texas Children's Hospital" in all_text
@@ -228,28 +218,14 @@ def extract_information_medical(response, pdf_text=None):
     # Process key-value pairs for patient and doctor information
     for key, value in kvs.items():
         key_lower = key.lower()
-        if any(term in key_lower for term in ["mother", "infant", "patient", "name", "dob", "date of birth", "phone"]):
+        if PATIENT_KEY_TERMS.contains_any(key_lower):
             patient_info[key] = value
-        elif any(term in key_lower for term in ["physician", "doctor", "md", "prescribing"]):
+        elif DOCTOR_KEY_TERMS.contains_any(key_lower):
             doctor_info[key] = value
 
-    # Extract patient information through pattern matching
-    # Common patterns for patient details
-    patterns = [
-        (r"(?:Mother|Patient)\s*Name[:\s]+([^:\n]+)", "Patient Name"),
-        (r"(?:Mother|Patient)?\s*Date of [Bb]irth[:\s]+([^:\n]+)", "Date of Birth"),
-        (r"(?:Mother|Patient)?\s*DOB[:\s]+([^:\n]+)", "DOB"),
-        (r"(?:Mother|Patient)?\s*Phone\s*(?:Number)?[:\s]+([^:\n]+)", "Phone Number"),
-        (r"(?:Infant|Baby)\s*Name[:\s]+([^:\n]+)", "Infant Name"),
-        (r"(?:Infant|Baby)\s*Date of [Bb]irth[:\s]+([^:\n]+)", "Infant Date of Birth"),
-        (r"EDD[:\s]+([^:\n]+)", "EDD")
-    ]
-
-    # Apply all patterns to all_text
-    for pattern, field_name in patterns:
-        matches = re.findall(pattern, all_text, re.IGNORECASE)
-        if matches:
-            patient_info[field_name] = matches[0].strip()
+    # Extract patient information through pattern matching in one pass over all_text
+    for field_name, match in PATIENT_FIELD_PATTERNS.first_matches(all_text).items():
+        patient_info[field_name] = match.strip()
     
     # PRESCRIPTION INFORMATION EXTRACTION - FORMAT SPECIFIC
     if is_texas_childrens:
@@ -316,17 +292,8 @@ def extract_information_medical(response, pdf_text=None):
             prescription_info["ICD-10 Code"] = icd_codes[0]
         
         # Look for breast pump mentions
-        pump_patterns = [
-            r"breast pump", 
-            r"double electric", 
-            r"double-electric",
-            r"electric breast pump"
-        ]
-        
-        for pattern in pump_patterns:
-            if re.search(pattern, all_text, re.IGNORECASE):
-                prescription_info["Prescription"] = "Double Electric Breast Pump"
-                break
+        if PUMP_TERMS.contains_any(all_text.lower()):
+            prescription_info["Prescription"] = "Double Electric Breast Pump"
 
     # Clean up data by removing duplicates and empty values
     patient_info = {k.replace(":", "").strip(): v for k, v in patient_info.items() if v and v.strip()}
@@ -435,23 +402,12 @@ def extract_information_signed_agreement(response, pdf_text, object_key):
             f.write(pdf_text)
         
         # Look for "Signed by customer:" pattern
-        name_patterns = [
-            r"Signed by customer\s*:\s*([^\n\.;,]+)",
-            r"Signed by\s*:\s*([^\n\.;,]+)",
-            r"Customer\s*:\s*([^\n\.;,]+)"
-        ]
-        
-        for pattern in name_patterns:
-            matches = re.findall(pattern, pdf_text, re.IGNORECASE)
-            if matches:
-                for match in matches:
-                    name = match.strip()
-                    if len(name) > 2 and len(name) < 50:  # Reasonable name length
-                        agreement_info["Customer/Patient Name"] = name
-                        print(f"Found customer name from PDF: {name}")
-                        break
-                if agreement_info["Customer/Patient Name"] != "No name found":
-                    break
+        for _, match in AGREEMENT_NAME_PATTERNS.iter_matches(pdf_text):
+            name = match.strip()
+            if len(name) > 2 and len(name) < 50:  # Reasonable name length
+                agreement_info["Customer/Patient Name"] = name
+                print(f"Found customer name from PDF: {name}")
+                break
     
     # If no name found, try once more with a broader approach
     if agreement_info["Customer/Patient Name"] == "No name found" and pdf_text:
@@ -469,23 +425,12 @@ def extract_information_signed_agreement(response, pdf_text, object_key):
                         break
     
     # Try to extract date from the PDF text
-    date_patterns = [
-        r"Date\s*:\s*(\d{2}/\d{2}/\d{4})",
-        r"Fecha\s*:\s*(\d{2}/\d{2}/\d{4})",
-        r"(\d{2}/\d{2}/\d{4})"
-    ]
-    
-    for pattern in date_patterns:
-        matches = re.findall(pattern, pdf_text, re.IGNORECASE)
-        if matches:
-            for match in matches:
-                date = match.strip()
-                if len(date) == 10:  # Reasonable date length
-                    agreement_info["Date"] = date
-                    print(f"Found date from PDF: {date}")
-                    break
-            if agreement_info["Date"] != "No date found":
-                break
+    for _, match in AGREEMENT_DATE_PATTERNS.iter_matches(pdf_text or ""):
+        date = match.strip()
+        if len(date) == 10:  # Reasonable date length
+            agreement_info["Date"] = date
+            print(f"Found date from PDF: {date}")
+            break
     
     # Detect signature
     signature_present = detect_signature(response)
@@ -493,44 +438,6 @@ def extract_information_signed_agreement(response, pdf_text, object_key):
     
     return agreement_info
 
-def detect_signature(response):
-    try:
-        blocks = response.get('Blocks', [])
-        
-        # Method 1: Check for SIGNATURE block type
-        for block in blocks:
-            if block.get('BlockType') == 'SIGNATURE':
-                print(f"Signature detected via SIGNATURE block type")
-                return True
-                
-        # Method 2: Look for lines that might be signatures
-        for block in blocks:
-            if block.get('BlockType') == 'LINE':
-                if 'Geometry' in block:
-                    geometry = block.get('Geometry', {})
-                    bbox = geometry.get('BoundingBox', {})
-                    width = bbox.get('Width', 0)
-                    height = bbox.get('Height', 0)
-                    
-                    if width > 0.2 and height < 0.05 and 'Text' not in block:
-                        print(f"Possible signature detected via geometry analysis")
-                        return True
-        
-        # Method 3: Check for specific text indicators
-        all_text = ' '.join([block.get('Text', '').lower() for block in blocks if 'Text' in block])
-        signature_indicators = ["signature", "signed", "/s/"]
-        for indicator in signature_indicators:
-            if indicator in all_text:
-                print(f"Signature presence inferred from text: '{indicator}'")
-                return True
-                
-        print("No signatures detected.")
-        return False
-        
-    except Exception as e:
-        print(f"Error in signature detection: {e}")
-        return False
-
 def determine_document_type(object_key):
     """Determine the type of document based on filename or extension"""
     file_extension = object_key.split('.')[-1].lower()
@@ -564,20 +471,19 @@ def determine_document_type(object_key):
     else:
         return "unknown"
     
+# Medical and agreement indicators, counted together in one pass over the text
+CONTENT_TYPE_SCORER = KeywordScorer({
+    "medical": ["patient", "doctor", "hospital", "clinic", "prescription", 
+                "medical", "health", "physician", "diagnosis"],
+    "agreement": ["agreement", "contract", "consent", "sign", "signature", 
+                  "terms", "conditions", "acknowledge"]
+})
+
 def refine_document_type(document_type, extracted_text):
     """Refine the document type based on the content"""
-    lower_text = extracted_text.lower()
-    
-    # Check for medical indicators
-    medical_indicators = ["patient", "doctor", "hospital", "clinic", "prescription", 
-                          "medical", "health", "physician", "diagnosis"]
-    
-    # Check for agreement indicators
-    agreement_indicators = ["agreement", "contract", "consent", "sign", "signature", 
-                           "terms", "conditions", "acknowledge"]
-    
-    medical_score = sum(1 for indicator in medical_indicators if indicator in lower_text)
-    agreement_score = sum(1 for indicator in agreement_indicators if indicator in lower_text)
+    scores = CONTENT_TYPE_SCORER.score(extracted_text)
+    medical_score = scores["medical"]
+    agreement_score = scores["agreement"]
     
     if medical_score > agreement_score:
         return "medical"
@@ -601,7 +507,7 @@ def process_document(bucket_name, object_key):
         print("Failed to extract text data from document.")
         return None
     
-    # For PDFs, also extract text directly using PyPDF2
+    # For PDFs, also extract the text layer directly
     pdf_text = None
     if file_extension == 'pdf':
         pdf_text = extract_text_from_pdf(bucket_name, object_key)
@@ -728,9 +634,13 @@ def main(bucket_name, entity_tag_to_find, index=None):
             json_output = json.dumps(extracted_info, indent=4)
             print(f"Extracted Information in JSON format:\n{json_output}")
             
-            # Save the JSON output to a file
-            with open("extracted_info.json", "w") as json_file:
-                json_file.write(json_output)
+            # Append to the results stream instead of overwriting extracted_info.json on every run
+            with RotatingNDJSONSink(RESULTS_DIR, "extracted_info", compress=COMPRESS_RESULTS) as results:
+                results.add({
+                    "object_key": object_key,
+                    "extracted_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "data": extracted_info
+                })
         else:
             print("Failed to extract information from document.")
     else:
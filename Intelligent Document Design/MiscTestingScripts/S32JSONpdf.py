@@ -2,8 +2,12 @@ import os
 import boto3
 import json
 import time
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedCode.kv_resolution import resolve_kv_map
+
 # Load environment variables
 load_dotenv()
 
@@ -119,52 +123,11 @@ def extract_information(response):
     patient_info = {}
     doctor_info = {}
 
-    key_map = {}
-    value_map = {}
-    block_map = {}
-
     blocks = response.get('Blocks', [])
     if not blocks:
         raise ValueError("No blocks found in Textract response")
 
-    for block in blocks:
-        block_id = block['Id']
-        block_map[block_id] = block
-        if block['BlockType'] == "KEY_VALUE_SET":
-            if 'KEY' in block['EntityTypes']:
-                key_map[block_id] = block
-            else:
-                value_map[block_id] = block
-
-    def get_kv_relationship(key_map, value_map, block_map):
-        kvs = {}
-        for block_id, key_block in key_map.items():
-            value_block = None
-            for relationship in key_block.get('Relationships', []):
-                if relationship['Type'] == 'VALUE':
-                    for value_id in relationship['Ids']:
-                        value_block = value_map.get(value_id)
-                        break
-            key = get_text(key_block, block_map)
-            value = get_text(value_block, block_map)
-            kvs[key] = value
-        return kvs
-
-    def get_text(result, blocks_map):
-        text = ''
-        if result and 'Relationships' in result:
-            for relationship in result['Relationships']:
-                if relationship['Type'] == 'CHILD':
-                    for child_id in relationship['Ids']:
-                        word = blocks_map[child_id]
-                        if word['BlockType'] == 'WORD':
-                            text += word['Text'] + ' '
-                        if word['BlockType'] == 'SELECTION_ELEMENT':
-                            if word['SelectionStatus'] == 'SELECTED':
-                                text += 'X '
-        return text.strip()
-
-    kvs = get_kv_relationship(key_map, value_map, block_map)
+    kvs = resolve_kv_map(blocks)
 
     for key, value in kvs.items():
         if "Mother" in key or "Infant" in key:
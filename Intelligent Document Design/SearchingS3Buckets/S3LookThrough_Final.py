@@ -1,10 +1,13 @@
 import boto3
 import os
-import hashlib
+import sys
 from dotenv import load_dotenv
-from PIL import Image
 import webbrowser
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedCode.local_cache import LocalObjectCache
+from sharedCode.preflight import TEXTRACT_FORMATS, preflight_object
+
 load_dotenv()
 
 # AWS Credentials (optional if configured via AWS CLI or environment variables)
@@ -20,6 +23,9 @@ s3_client = boto3.client(
     aws_secret_access_key=aws_secret_key
 )
 
+# Downloads are kept in a size-limited cache (OBJECT_CACHE_DIR / OBJECT_CACHE_MAX_MB in .env)
+object_cache = LocalObjectCache(s3_client)
+
 # Get a list of all object keys and their ETags in the S3 bucket
 def list_s3_objects(bucket_name):
     s3_keys = []
@@ -37,25 +43,6 @@ def list_s3_objects(bucket_name):
 # Fetch all document keys and their corresponding ETags
 s3_keys, s3_etags = list_s3_objects(bucket_name)
 
-# Compute file hash (MD5) for integrity check
-def compute_file_hash(file_path):
-    hash_md5 = hashlib.md5()
-    with open(file_path, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
-
-# Validate if the file is a proper image using Pillow
-def validate_image(file_path):
-    try:
-        with Image.open(file_path) as img:
-            img.verify()  # Check if it's a valid image
-            print(f"✅ The file {file_path} is a valid image.")
-            return True
-    except Exception as e:
-        print(f"❌ Error validating image: {e}")
-        return False
-
 # Open the file in the default application using os.startfile (Windows only)
 
 # Open the file in the default browser
@@ -92,39 +79,21 @@ def open_file_from_s3(index=None, entity_tag=None):
         print('Error: You must provide either an index or an entity tag.')
         return
     
-    # Set the local path to save the file in the "Downloads" folder
-    downloads_path = os.path.join(os.path.expanduser('~'), 'Downloads')
-    local_file_name = os.path.join(downloads_path, f'temp_{object_key.split("/")[-1]}')
-
-    # Remove any unwanted suffix from file name (e.g., .null.jpg)
-    local_file_name = local_file_name.replace('.null.jpg', '')
-
-    # Check if the file already exists and is a valid image
-    if os.path.exists(local_file_name):
-        print(f"✅ File already exists: {local_file_name}")
-        if validate_image(local_file_name):  # Validate if the file is a proper image
-            open_file(local_file_name)
-        return
-
     try:
-        # Download the file in binary mode if it doesn't exist
-        with open(local_file_name, 'wb') as file:
-            s3_client.download_fileobj(bucket_name, object_key, file)
-        
-        # Verify the downloaded file size and integrity
-        file_size = os.path.getsize(local_file_name)
-        print(f'File downloaded with size: {file_size} bytes.')
-
-        if file_size == 0:
-            print(f"❌ The downloaded file appears empty. Check the download process.")
+        # Check the real format from the first few KB before downloading the whole file
+        preflight = preflight_object(s3_client, bucket_name, object_key, TEXTRACT_FORMATS)
+        if preflight["reason"]:
+            print(f"❌ Not opening {object_key}: {preflight['reason']}")
             return
-        
-        # Validate the image using Pillow
-        if validate_image(local_file_name):
-            # Compute and compare file hash (MD5) for integrity
-            local_hash = compute_file_hash(local_file_name)
-            print(f"Local file hash: {local_hash}")
-        
+        dimensions = f", {preflight['width']}x{preflight['height']}" if preflight["width"] else ""
+        print(f"✅ {preflight['format']} file, {preflight['size']} bytes{dimensions}")
+
+        # Reuse the cached copy when its ETag still matches the listing, otherwise download it.
+        # Downloads are hashed as they stream in and checked against the ETag, so a corrupt
+        # file raises here instead of being opened.
+        local_file_name = object_cache.get_path(bucket_name, object_key, s3_etags[object_key])
+        print(f"✅ Verified local copy: {local_file_name}")
+
         # Open the file using the default associated application
         open_file(local_file_name)
 
@@ -0,0 +1,39 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedCode.content_classification import classify_pages
+
+REPEATS = 200
+# Filler page with no classification keywords, as the middle pages of a long scan often are
+FILLER = "lorem ipsum dolor sit amet " * 100
+PRESCRIPTION_PAGE = "Prescription for breast pump. Physician: Dr. Smith. Diagnosis: lactation. Patient name: Jane Doe"
+AGREEMENT_PAGE = "Customer agreement. I agree to the terms and conditions and acknowledge my consent. Signature"
+INSURANCE_PAGE = "Insurance card. Member ID# 123. Group 456. Plan: PPO. Copay $20"
+
+# Documents whose type a page late in the file changes or settles
+DOCUMENTS = {
+    "insurance card on page 1": [INSURANCE_PAGE] + [FILLER] * 20,
+    "insurance card after rx": [PRESCRIPTION_PAGE] + [FILLER] * 10 + [INSURANCE_PAGE],
+    "agreement overtakes rx": [PRESCRIPTION_PAGE] + [FILLER] * 10 + [AGREEMENT_PAGE],
+    "prescription only": [PRESCRIPTION_PAGE] + [FILLER] * 20,
+}
+
+
+def timed(page_texts, stop_early):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        # Pages come from a generator, as iter_pdf_pages yields them
+        result = classify_pages(iter(page_texts), stop_early)
+    return (time.perf_counter() - start) / REPEATS, result
+
+
+if __name__ == "__main__":
+    for label, page_texts in DOCUMENTS.items():
+        full_time, (full_result, full_pages, _) = timed(page_texts, stop_early=False)
+        early_time, (early_result, early_pages, _) = timed(page_texts, stop_early=True)
+        # Stopping early must never change the document type
+        assert early_result[0] == full_result[0], (label, full_result, early_result)
+        print(f"{label:26s} {full_result[0]:17s} every page {full_pages:3d} pages {full_time * 1000:6.3f} ms   "
+              f"early exit {early_pages:3d} pages {early_time * 1000:6.3f} ms")
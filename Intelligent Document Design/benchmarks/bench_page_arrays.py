@@ -0,0 +1,84 @@
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedCode.page_arrays import PageArrays, near_label_mask, signature_line_mask, text_mask
+
+# Synthetic page of LINE blocks with a few signature labels mixed in
+BLOCK_COUNT = 10000
+REPEATS = 20
+LABEL_TEXTS = ["Signature:", "Signed by customer:"]
+
+
+def make_page(count, seed=0):
+    rng = random.Random(seed)
+    blocks = []
+    for i in range(count):
+        text = rng.choice(LABEL_TEXTS) if i % 500 == 0 else f"line {i}"
+        blocks.append({
+            "Id": str(i),
+            "BlockType": "LINE",
+            "Text": text,
+            "Geometry": {"BoundingBox": {
+                "Left": rng.random() * 0.8,
+                "Top": rng.random() * 0.95,
+                "Width": rng.random() * 0.4,
+                "Height": rng.random() * 0.06,
+            }},
+        })
+    return blocks
+
+
+def is_label(text):
+    return "signature" in text.lower() or "signed by" in text.lower()
+
+
+def loop_heuristics(blocks):
+    """Plain Python version of the signature check, one block at a time"""
+    boxes = []
+    for block in blocks:
+        bbox = block["Geometry"]["BoundingBox"]
+        boxes.append((bbox["Left"], bbox["Top"], bbox["Left"] + bbox["Width"], bbox["Top"] + bbox["Height"]))
+    labels = {i for i, block in enumerate(blocks) if is_label(block.get("Text", ""))}
+
+    signatures = 0
+    for i, (left, top, right, bottom) in enumerate(boxes):
+        if i in labels or not (right - left > 0.2 and bottom - top < 0.05):
+            continue
+        for j in labels:
+            l_left, l_top, l_right, l_bottom = boxes[j]
+            right_of = top <= l_bottom and bottom >= l_top and 0 <= left - l_right <= 0.4
+            below = left <= l_right and right >= l_left and 0 <= top - l_bottom <= 0.1
+            if right_of or below:
+                signatures += 1
+                break
+    return signatures
+
+
+def array_heuristics(arrays):
+    labels = text_mask(arrays, is_label)
+    return int(near_label_mask(arrays, labels, candidate_mask=signature_line_mask(arrays)).sum())
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        result = function(*args)
+    return (time.perf_counter() - start) / REPEATS, result
+
+
+if __name__ == "__main__":
+    blocks = make_page(BLOCK_COUNT)
+
+    build_time, arrays = timed(PageArrays, blocks)
+    loop_time, loop_result = timed(loop_heuristics, blocks)
+    array_time, array_result = timed(array_heuristics, arrays)
+
+    print(f"{BLOCK_COUNT} blocks, {REPEATS} repeats")
+    print(f"python loop:       {loop_time * 1000:8.2f} ms  signatures = {loop_result}")
+    print(f"build PageArrays:  {build_time * 1000:8.2f} ms")
+    print(f"vectorized masks:  {array_time * 1000:8.2f} ms  signatures = {array_result}")
+    print(f"speedup (masks only):      {loop_time / array_time:6.1f}x")
+    print(f"speedup (build + masks):   {loop_time / (build_time + array_time):6.1f}x")
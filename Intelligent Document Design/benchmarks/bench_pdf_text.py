@@ -0,0 +1,121 @@
+import difflib
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedCode.pdf_text import PDF_TEXT_BACKENDS, get_pdf_text_backend
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Usage: python bench_pdf_text.py [folder of sample PDFs]
+# A sample.txt next to sample.pdf is used as the reference text for the fidelity score.
+# With no folder, a few synthetic agreements are generated with PyMuPDF.
+
+SAMPLE_LINES = [
+    "CUSTOMER RIGHTS AND RESPONSIBILITIES AGREEMENT",
+    "I acknowledge that I have received the breast pump described below.",
+    "Signed by customer: Jane Doe",
+    "Date: 07/13/2024 07:04 CMT",
+    "Firmado por el cliente: Jane Doe",
+    "Fecha: 07/13/2024",
+]
+
+
+def make_samples(folder, documents=5, pages=40):
+    fitz = get_pdf_text_backend("pymupdf")._fitz
+    for number in range(documents):
+        pdf = fitz.open()
+        reference = []
+        for page_number in range(pages):
+            page = pdf.new_page()
+            lines = [f"Page {page_number + 1} of {pages}"] + SAMPLE_LINES
+            page.insert_text((72, 72), "\n".join(lines), fontsize=11)
+            reference.extend(lines)
+        path = os.path.join(folder, f"sample_{number}.pdf")
+        pdf.save(path)
+        pdf.close()
+        with open(path[:-4] + ".txt", "w", encoding="utf-8") as reference_file:
+            reference_file.write("\n".join(reference))
+
+
+def fidelity(text, reference):
+    """Word-level similarity between extracted text and the reference, 0 to 1"""
+    return difflib.SequenceMatcher(None, text.split(), reference.split(), autojunk=False).ratio()
+
+
+def run_backend(backend_name, paths, results):
+    backend = get_pdf_text_backend(backend_name)
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+
+    pages = 0
+    scores = []
+    start = time.perf_counter()
+    for path in paths:
+        with open(path, "rb") as pdf_file:
+            page_texts = list(backend.iter_page_text(pdf_file))
+        pages += len(page_texts)
+        reference_path = path[:-4] + ".txt"
+        if os.path.exists(reference_path):
+            with open(reference_path, encoding="utf-8") as reference_file:
+                scores.append(fidelity("\n".join(page_texts), reference_file.read()))
+    elapsed = time.perf_counter() - start
+
+    peak_rss = None
+    if resource:
+        # ru_maxrss is KB on Linux and bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        peak_rss = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss) * scale
+
+    results.put({
+        "backend": backend_name,
+        "pages": pages,
+        "seconds": elapsed,
+        "pages_per_second": pages / elapsed if elapsed else 0,
+        "peak_rss_growth_mb": peak_rss / (1024 * 1024) if peak_rss is not None else None,
+        "fidelity": sum(scores) / len(scores) if scores else None,
+    })
+
+
+def main():
+    folder = sys.argv[1] if len(sys.argv) > 1 else None
+    temp_dir = None
+    if folder is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        folder = temp_dir.name
+        make_samples(folder)
+    paths = sorted(glob.glob(os.path.join(folder, "*.pdf")))
+    print(f"{len(paths)} PDFs from {folder}")
+
+    # Each backend runs in a fresh process so the memory numbers do not mix
+    context = multiprocessing.get_context("spawn")
+    summary = []
+    for backend_name in PDF_TEXT_BACKENDS:
+        results = context.Queue()
+        worker = context.Process(target=run_backend, args=(backend_name, paths, results))
+        worker.start()
+        worker.join()
+        if worker.exitcode != 0:
+            print(f"{backend_name}: failed or not installed")
+            continue
+        summary.append(results.get())
+
+    for row in summary:
+        memory = f"{row['peak_rss_growth_mb']:.1f} MB" if row["peak_rss_growth_mb"] is not None else "n/a"
+        score = f"{row['fidelity']:.3f}" if row["fidelity"] is not None else "n/a"
+        print(f"{row['backend']:>8}: {row['pages_per_second']:8.1f} pages/s  peak RSS +{memory}  fidelity {score}")
+    print(json.dumps(summary, indent=4))
+
+    if temp_dir:
+        temp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedCode.reparse import find_reparse_jobs, reparse_documents
+from sharedCode.response_archive import ResponseArchive, request_fingerprint
+from sharedCode.textract_queries import FACESHEET_REQUESTS
+
+# Facesheet-shaped archive: two query responses per document, each with a page of text
+DOCUMENTS = 2000
+LINES_PER_PAGE = 60
+
+
+def geometry():
+    box = {"Width": random.random(), "Height": random.random(), "Left": random.random(), "Top": random.random()}
+    return {"BoundingBox": box, "Polygon": [{"X": random.random(), "Y": random.random()} for _ in range(4)]}
+
+
+def query_response(request, document):
+    page = {"BlockType": "PAGE", "Id": "page", "Geometry": geometry(), "Page": 1,
+            "Relationships": [{"Type": "CHILD", "Ids": []}]}
+    blocks = [page]
+    for i in range(LINES_PER_PAGE):
+        blocks.append({"BlockType": "LINE", "Id": f"line-{i}", "Text": f"Line {i} of document {document}",
+                       "Confidence": 99.0, "Geometry": geometry(), "Page": 1})
+        page["Relationships"][0]["Ids"].append(f"line-{i}")
+    for i, query in enumerate(request["QueriesConfig"]["Queries"]):
+        blocks.append({"BlockType": "QUERY", "Id": f"query-{i}", "Page": 1, "Query": query,
+                       "Relationships": [{"Type": "ANSWER", "Ids": [f"answer-{i}"]}]})
+        blocks.append({"BlockType": "QUERY_RESULT", "Id": f"answer-{i}", "Text": f"{query['Alias']} {document}",
+                       "Confidence": 90.0, "Geometry": geometry(), "Page": 1})
+        page["Relationships"][0]["Ids"].append(f"query-{i}")
+    return {"DocumentMetadata": {"Pages": 1}, "Blocks": blocks}
+
+
+def timed(jobs, workers):
+    start = time.perf_counter()
+    failed = sum(1 for *_, error in reparse_documents(jobs, workers) if error)
+    total = time.perf_counter() - start
+    label = "inline" if workers == 0 else f"{os.cpu_count()} workers"
+    print(f"{label:12s} {len(jobs) / total:8.0f} documents/s ({total:.2f}s, {failed} failed)")
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as directory:
+        with ResponseArchive(directory) as archive:
+            fingerprints = [request_fingerprint(request) for request in FACESHEET_REQUESTS]
+            for document in range(DOCUMENTS):
+                for request, fingerprint in zip(FACESHEET_REQUESTS, fingerprints):
+                    archive.put(f"facesheet-{document}.jpg", f"{document:032x}", fingerprint,
+                                query_response(request, document), "facesheet")
+            print(archive.report())
+            jobs, missing = find_reparse_jobs(archive, ["facesheet"])
+        timed(jobs, 0)
+        timed(jobs, None)
@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedCode.background_writer import BackgroundResultWriter
+from sharedCode.json_codec import dumps_compact
+from sharedCode.result_schema import FIELD_TABLE
+from sharedCode.result_sink import PostgresResultSink, SQLiteResultSink
+from sharedCode.textract_queries import FACESHEET_REQUESTS, query_aliases
+
+# Facesheet-shaped results: 30 fields per document
+DOCUMENTS = 20000
+ALIASES = query_aliases(FACESHEET_REQUESTS)
+# Set to a libpq connection string to also time the Postgres sink (the tables are dropped afterwards)
+POSTGRES_DSN = os.getenv("BENCH_POSTGRES_DSN")
+
+
+def run(store):
+    store.prepare(ALIASES)
+    writer = BackgroundResultWriter(store)
+    start = time.perf_counter()
+    for i in range(DOCUMENTS):
+        data = {alias: f"{alias} value {i}" for alias in ALIASES}
+        queryData = {"confidence": {"confidence_score": 1.0}, "document_data": data}
+        writer.add(f"document-{i}.jpg", "etag", dumps_compact(queryData), 1.0,
+                   fields=[(alias, value, 0.95) for alias, value in data.items()])
+    queued = time.perf_counter() - start
+    writer.close()
+    total = time.perf_counter() - start
+    print(f"{type(store).__name__:20s} {DOCUMENTS / total:8.0f} documents/s "
+          f"({total:.2f}s total, {queued:.2f}s for the loop to queue them)")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        run(SQLiteResultSink(os.path.join(directory, "results.db"), "facesheet", field_table=FIELD_TABLE))
+
+    if POSTGRES_DSN:
+        import psycopg2
+        from psycopg2.pool import ThreadedConnectionPool
+
+        pool = ThreadedConnectionPool(1, 2, POSTGRES_DSN)
+        try:
+            run(PostgresResultSink(None, "facesheet", pool=pool, field_table=FIELD_TABLE))
+        finally:
+            pool.closeall()
+            connection = psycopg2.connect(POSTGRES_DSN)
+            with connection, connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS facesheet, {FIELD_TABLE} CASCADE")
+            connection.close()
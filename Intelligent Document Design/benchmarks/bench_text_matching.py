@@ -0,0 +1,106 @@
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedCode.medical_extraction import PATIENT_FIELD_PATTERNS
+from sharedCode.text_matching import KeywordScorer, KeywordSet, ahocorasick
+
+# About 32 KB of lowercase page text built from words the documents actually use
+TEXT_BYTES = 32 * 1024
+REPEATS = 200
+VOCABULARY = ["the", "patient", "name", "date", "of", "birth", "physician", "signature", "insurance", "member",
+              "policy", "plan", "order", "device", "supply", "address", "phone", "doctor", "notes", "medical"]
+
+PUMP_TERMS = ["breast pump", "double electric", "double-electric", "electric breast pump"]
+CATEGORIES = {
+    "prescription": ["prescription", "rx", "physician", "doctor", "diagnosis", "patient name", "mother name",
+                     "mother's name", "breast pump", "icd-10", "medical necessity", "dob", "date of birth"],
+    "agreement": ["agreement", "signature", "signed", "consent", "terms", "conditions", "i agree", "customer",
+                  "acknowledge"],
+    "insurance": ["insurance", "member", "policy", "group", "copay", "deductible", "plan", "coverage", "id#",
+                  "id #", "insured", "subscriber"],
+}
+# Field lines near the top of a prescription, as extract_information_medical sees them
+FIELD_LINES = "Patient Name: Jane Doe\nDate of Birth: 01/02/1990\nPhone Number: 555-0100\nInfant Name: Baby Doe\n"
+# Large synthetic list, for how the cost grows with the number of keywords
+MANY_KEYWORDS = 3000
+
+
+def make_text(seed=0):
+    rng = random.Random(seed)
+    words = []
+    size = 0
+    while size < TEXT_BYTES:
+        word = rng.choice(VOCABULARY)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        result = function(*args)
+    return (time.perf_counter() - start) / REPEATS, result
+
+
+def report(label, baseline, new):
+    (baseline_time, baseline_result), (new_time, new_result) = baseline, new
+    assert baseline_result == new_result, (label, baseline_result, new_result)
+    print(f"{label:28s} baseline {baseline_time * 1000:7.3f} ms   new {new_time * 1000:7.3f} ms   "
+          f"{baseline_time / new_time:6.1f}x")
+
+
+def search_loop(text):
+    """What extract_information_medical did before: one re.search per pump pattern"""
+    return any(re.search(pattern, text, re.IGNORECASE) for pattern in PUMP_TERMS)
+
+
+def findall_loop(text):
+    """What extract_information_medical did before: one re.findall per field pattern, keeping the first"""
+    results = {}
+    for name, compiled in PATIENT_FIELD_PATTERNS.patterns:
+        matches = re.findall(compiled.pattern, text, re.IGNORECASE)
+        if matches and name not in results:
+            results[name] = matches[0].strip()
+    return results
+
+
+def first_matches(text):
+    return {name: value.strip() for name, value in PATIENT_FIELD_PATTERNS.first_matches(text).items()}
+
+
+def count_loop(text):
+    """What the classifiers did before: one `in` per keyword per category"""
+    lower_text = text.lower()
+    return {category: sum(1 for keyword in keywords if keyword in lower_text)
+            for category, keywords in CATEGORIES.items()}
+
+
+if __name__ == "__main__":
+    text = make_text()
+    lower_text = text.lower()
+    print(f"{len(text)} characters of text, {REPEATS} repeats, "
+          f"pyahocorasick {'installed' if ahocorasick else 'not installed'}")
+
+    pump_terms = KeywordSet(PUMP_TERMS)
+    report("pump terms (contains_any)", timed(search_loop, text),
+           timed(lambda text: pump_terms.contains_any(text.lower()), text))
+
+    scorer = KeywordScorer(CATEGORIES)
+    report(f"classifier ({sum(map(len, CATEGORIES.values()))} keywords)", timed(count_loop, text),
+           timed(scorer.score, text))
+
+    field_text = FIELD_LINES + text
+    report(f"field patterns ({len(PATIENT_FIELD_PATTERNS.patterns)})", timed(findall_loop, field_text),
+           timed(first_matches, field_text))
+
+    rng = random.Random(1)
+    keywords = sorted({"".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(8))
+                       for _ in range(MANY_KEYWORDS)} | set(VOCABULARY[:5]))
+    plain = KeywordSet(keywords, min_automaton_keywords=len(keywords) + 1)
+    report(f"{len(keywords)} keywords (matched)", timed(plain.matched, lower_text),
+           timed(KeywordSet(keywords).matched, lower_text))
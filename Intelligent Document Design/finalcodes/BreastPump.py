@@ -1,14 +1,23 @@
 import os
 import boto3
-import botocore
-import json
 from dotenv import load_dotenv
 from textractcaller.t_call import call_textract
 from textractprettyprinter.t_pretty_print import (Textract_Pretty_Print, get_string)
-import trp.trp2 as t2
 from tabulate import tabulate
-import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 from collections import Counter
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedCode.background_writer import BackgroundResultWriter
+from sharedCode.json_codec import dumps_compact
+from sharedCode.page_packing import analyze_documents, is_pack_key
+from sharedCode.preflight import IMAGE_FORMATS
+from sharedCode.query_results import parse_query_responses
+from sharedCode.response_archive import ResponseArchive, request_fingerprint
+from sharedCode.result_schema import FIELD_TABLE
+from sharedCode.result_sink import PostgresResultSink, SQLiteResultSink
+from sharedCode.textract_queries import BREAST_PUMP_REQUESTS, query_aliases
 
 load_dotenv()
 
@@ -21,7 +30,10 @@ db_port = os.getenv("DB_PORT")
 db_name = os.getenv("DB_NAME")
 db_user = os.getenv("DB_USER")
 db_pass = os.getenv("DB_PASS")
+result_sqlite_path = os.getenv("RESULT_SQLITE_PATH")
 maxSize = 10*1024*1024
+# Small images are packed this many to a PDF and analyzed with one async job (0 = one synchronous request per image)
+packSize = 25
 
 
 s3 = boto3.client('s3',
@@ -39,6 +51,7 @@ def getObjectNames(bucket_name):
     page_iterator = paginator.paginate(**operation_parameters)
 
     object_keys = []
+    etags = {}
     page_iterator = iter(page_iterator)
 
     #if want to run this on a specific range of documents, use the code below and adjust page to
@@ -49,124 +62,70 @@ def getObjectNames(bucket_name):
     # if page and 'Contents' in page:
     #     for item in page['Contents']:
     #         object_keys.append(item['Key'])
+    #         etags[item['Key']] = item['ETag'].strip('"')
     #         if len(object_keys) >= 7:
     #             break
-    # return object_keys
+    # return object_keys, etags
 
     #code below runs it on the entire database
 
     for page in page_iterator:
         if 'Contents' in page:
             for item in page['Contents']:
+                # Packed PDFs staged for Textract are not documents
+                if is_pack_key(item['Key']):
+                    continue
                 object_keys.append(item['Key'])
-    return object_keys
+                etags[item['Key']] = item['ETag'].strip('"')
+    return object_keys, etags
 
-def get_db_connection():
-    return psycopg2.connect(host=db_endpoint,
-                            port=db_port,
-                            database=db_name,
-                            user=db_user,
-                            password=db_pass,
-                            sslrootcert="SSLCERTIFICATE")
+def get_db_pool():
+    # Connections for the background result writer, which borrows one per batch
+    return ThreadedConnectionPool(1, 2,
+                                  host=db_endpoint,
+                                  port=db_port,
+                                  database=db_name,
+                                  user=db_user,
+                                  password=db_pass,
+                                  sslrootcert="SSLCERTIFICATE")
 
-def detect_signature(response):
-    blocks = response.get('Blocks', [])
-    for block in blocks:
-        if block.get('BlockType') == 'SIGNATURE':
-            return "Present" 
-    return ""
-
-
-testing = getObjectNames(bucket_name)
+testing, etags = getObjectNames(bucket_name)
 
 # print(len(testing))# testing how many objects were retreieved
 
-connection = get_db_connection()
-cursor = connection.cursor()
-
-for index, docNames in enumerate(testing):
+# Results go to Postgres, or to a local SQLite file when RESULT_SQLITE_PATH is set (runs without a database server)
+connectionPool = None if result_sqlite_path else get_db_pool()
+if connectionPool:
+    resultStore = PostgresResultSink(None, "breastpump", pool=connectionPool, field_table=FIELD_TABLE)
+else:
+    resultStore = SQLiteResultSink(result_sqlite_path, "breastpump", field_table=FIELD_TABLE)
+resultStore.prepare(query_aliases(BREAST_PUMP_REQUESTS) + ["PHYSICIAN_SIGNATURE"])
+# Documents whose current version is already stored are skipped before any S3 or Textract call,
+# so a rerun only pays for new or changed objects
+testing = resultStore.unprocessed(testing, etags)
+print(f"{len(testing)} documents to process")
+# Rows are written in batches (one INSERT and commit per batch) on a background thread,
+# so the Textract loop never waits on the database
+resultSink = BackgroundResultWriter(resultStore)
+# Every Textract response is kept (compressed, by ETag and request) so the results can be
+# re-parsed later without calling Textract again
+responseArchive = ResponseArchive()
+requestFingerprints = [request_fingerprint(request) for request in BREAST_PUMP_REQUESTS]
+
+for index, docNames, [response] in analyze_documents(s3, textract, bucket_name, testing, BREAST_PUMP_REQUESTS, IMAGE_FORMATS, maxSize, packSize):
     print(index)
-    sizeCheck = s3.head_object(Bucket=bucket_name, Key=docNames)
-    size = sizeCheck['ContentLength']
-
-# Check the file extension
-    if not docNames.endswith(('.jpg', '.jpeg', '.png', '.tiff')):
-        continue  # Skip if it's not an image file
-
-# Check the file size
-    response = s3.head_object(Bucket=bucket_name, Key=docNames)
-    size = response['ContentLength']
-
-    if size > maxSize:
-        continue  # Skip if the file is too large
-
-    if "026fc6e3b3eb47b9894ccb490be6885c_OUT_PATIENT_2024_07_13_07_04_56_0e6c137980dd4f789d6793b35f8172eb_INSURANCECARD_capturepng.null.png" in docNames:
-        continue
-
     try:
-        response = textract.analyze_document(
-        Document={'S3Object': {'Bucket': 'capstone-intelligent-document-processing', 'Name': (docNames)}},
-        FeatureTypes=["QUERIES", "SIGNATURES"],
-        QueriesConfig={"Queries": [
-        {"Text": "What is the Mother Name?", "Alias": "MOTHER_NAME"},
-        {"Text": "What is the Patient Name?", "Alias": "PATIENT_NAME"},
-        {"Text": "What is the Patient Phone Number?", "Alias": "PHONE_NUMBER"},
-        {"Text": "What is the Patient Date of Birth?", "Alias": "DOB"},
-        {"Text": "What is the Physician Name?", "Alias": "DOCTOR_NAME"},
-        {"Text": "What is the NPI Number?", "Alias": "NPI"},
-        {"Text": "What is the Medical Necessity?", "Alias": "MEDICAL_NEED"},
-        {"Text": "What is the Infant Name?", "Alias": "INFANT_NAME"},
-        {"Text": "What is the Infant Date of Birth?", "Alias": "INFANT_DOB"}
-        ]}
-        )
-
-        d = t2.TDocumentSchema().load(response)
-        page = d.pages[0]
-        query_answers = d.get_query_answers(page=page)
-        count=len(query_answers)
-
-        queryData={}
-        queryData["confidence"]={}
-        queryData["document_data"]={}
-        emptyCount = 0
-        keyCount = 0
-                
-        queryData["document_data"]["Physician Signature"] = detect_signature(response)
-
-        for i in range(count):
-            (a,b,c) = query_answers[i]
-            a = a.split("the ",1)[1]
-            a = a.split("?",1)[0]
-            queryData["document_data"][a] = c
-
-        for key, value in queryData["document_data"].items():
-            if key:
-                keyCount += 1
-            if value == "":
-                emptyCount += 1
-        
-        confidence_score = (keyCount-emptyCount)/keyCount
-        queryData["confidence"] = {"confidence_score": confidence_score}
-        # countTesting = Counter(queryData.values())# using counter to get number of empty values
-        # countTestingTest = countTesting[""]
-
-        # print(emptyCount)# manually checking how many values are empty
-        # print(keyCount-emptyCount)
-        # print(keyCount)
-        # print(confidence_score)
-
-        # print(json.dumps(queryData, indent=4))# checking the output
-
-        cursor.execute("INSERT INTO breastpump (document_key, json, confidence_score) VALUES (%s, %s, %s)",(docNames, json.dumps(queryData, indent=4), confidence_score))
-        connection.commit()
-    except textract.exceptions.UnsupportedDocumentException as e:
-        print(f"Unsupported document format for file: {docNames}, skipping.")
-        continue
-
-    except botocore.exceptions.ClientError as e:
-        print(f"A client error occurred for {docNames}: {e}")
-        continue
-
+        responseArchive.put(docNames, etags[docNames], requestFingerprints[0], response, "breastpump")
+        # Query answers by alias, the share answered, and the rows for the field table
+        queryData, confidence_score, fields = parse_query_responses([response], signature_alias="PHYSICIAN_SIGNATURE")
+        resultSink.add(docNames, etags[docNames], dumps_compact(queryData), confidence_score, fields=fields)
     except Exception as e:
         print(f"An unexpected error occurred for {docNames}: {e}")
         continue
+
+# Write whatever is still queued, update the per-field view, then release the connections
+resultSink.close()
+if connectionPool:
+    connectionPool.closeall()
+responseArchive.close()
+print(responseArchive.report())
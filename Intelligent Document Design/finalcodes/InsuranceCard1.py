@@ -4,10 +4,21 @@ import json
 from dotenv import load_dotenv
 from textractcaller.t_call import call_textract
 from textractprettyprinter.t_pretty_print import (Textract_Pretty_Print, get_string)
-import trp.trp2 as t2
 from tabulate import tabulate
-import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 from collections import Counter
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedCode.background_writer import BackgroundResultWriter
+from sharedCode.json_codec import dumps_compact
+from sharedCode.page_packing import analyze_documents, is_pack_key
+from sharedCode.preflight import IMAGE_FORMATS
+from sharedCode.query_results import parse_query_responses
+from sharedCode.response_archive import ResponseArchive, request_fingerprint
+from sharedCode.result_schema import FIELD_TABLE
+from sharedCode.result_sink import PostgresResultSink, SQLiteResultSink
+from sharedCode.textract_queries import INSURANCE_CARD1_REQUESTS, query_aliases
 
 load_dotenv()
 
@@ -20,7 +31,13 @@ db_port = os.getenv("DB_PORT")
 db_name = os.getenv("DB_NAME")
 db_user = os.getenv("DB_USER")
 db_pass = os.getenv("DB_PASS")
+result_sqlite_path = os.getenv("RESULT_SQLITE_PATH")
 maxSize = 10 * 1024 * 1024
+# Small images are packed this many to a PDF and analyzed with one async job (0 = one synchronous request per image)
+packSize = 25
+# Results are only printed while these queries are being tuned; set to True to store them
+# (documents already stored are then skipped before any Textract call)
+writeResults = False
 
 
 s3 = boto3.client('s3',
@@ -38,6 +55,7 @@ def getObjectNames(bucket_name):
     page_iterator = paginator.paginate(**operation_parameters)
 
     object_keys = []
+    etags = {}
     page_iterator = iter(page_iterator)
 
     #if want to run this on a specific range of documents, use the code below and adjust page to
@@ -47,10 +65,14 @@ def getObjectNames(bucket_name):
     page = next(page_iterator, None)
     if page and 'Contents' in page:
         for item in page['Contents']:
+            # Packed PDFs staged for Textract are not documents
+            if is_pack_key(item['Key']):
+                continue
             object_keys.append(item['Key'])
+            etags[item['Key']] = item['ETag'].strip('"')
             if len(object_keys) >= 36:
                 break
-    return object_keys
+    return object_keys, etags
 
     #code below runs it on the entire database
 
@@ -58,90 +80,64 @@ def getObjectNames(bucket_name):
     #     if 'Contents' in page:
     #         for item in page['Contents']:
     #             object_keys.append(item['Key'])
-    # return object_keys
+    #             etags[item['Key']] = item['ETag'].strip('"')
+    # return object_keys, etags
 
-def get_db_connection():
-    return psycopg2.connect(host=db_endpoint,
-                            port=db_port,
-                            database=db_name,
-                            user=db_user,
-                            password=db_pass,
-                            sslrootcert="SSLCERTIFICATE")
+def get_db_pool():
+    # Connections for the background result writer, which borrows one per batch
+    return ThreadedConnectionPool(1, 2,
+                                  host=db_endpoint,
+                                  port=db_port,
+                                  database=db_name,
+                                  user=db_user,
+                                  password=db_pass,
+                                  sslrootcert="SSLCERTIFICATE")
 
 
-testing = getObjectNames(bucket_name)
+testing, etags = getObjectNames(bucket_name)
 
 # print(len(testing))# testing how many objects were retreieved
 
-connection = get_db_connection()
-cursor = connection.cursor()
-
-for docNames in testing:
-    sizeCheck = s3.head_object(Bucket=bucket_name, Key=docNames)
-    size = sizeCheck['ContentLength']
-
-    if docNames.endswith(".pdf"):
-        continue
-
-    if size > maxSize:
+connectionPool = None
+resultSink = None
+if writeResults:
+    # Results go to Postgres, or to a local SQLite file when RESULT_SQLITE_PATH is set (runs without a database server)
+    connectionPool = None if result_sqlite_path else get_db_pool()
+    if connectionPool:
+        resultStore = PostgresResultSink(None, "insurance1", pool=connectionPool, field_table=FIELD_TABLE)
+    else:
+        resultStore = SQLiteResultSink(result_sqlite_path, "insurance1", field_table=FIELD_TABLE)
+    resultStore.prepare(query_aliases(INSURANCE_CARD1_REQUESTS))
+    # Documents whose current version is already stored are skipped before any S3 or Textract call,
+    # so a rerun only pays for new or changed objects
+    testing = resultStore.unprocessed(testing, etags)
+    print(f"{len(testing)} documents to process")
+    # Rows are written in batches (one INSERT and commit per batch) on a background thread,
+    # so the Textract loop never waits on the database
+    resultSink = BackgroundResultWriter(resultStore)
+# Every Textract response is kept (compressed, by ETag and request) so the results can be
+# re-parsed later without calling Textract again
+responseArchive = ResponseArchive()
+requestFingerprints = [request_fingerprint(request) for request in INSURANCE_CARD1_REQUESTS]
+
+for index, docNames, [response] in analyze_documents(s3, textract, bucket_name, testing, INSURANCE_CARD1_REQUESTS, IMAGE_FORMATS, maxSize, packSize):
+    print(index)
+    try:
+        responseArchive.put(docNames, etags[docNames], requestFingerprints[0], response, "insurance1")
+
+        # Query answers by alias, the share answered, and the rows for the field table
+        queryData, confidence_score, fields = parse_query_responses([response])
+        print(json.dumps(queryData, indent=4))# checking the output
+        if resultSink:
+            resultSink.add(docNames, etags[docNames], dumps_compact(queryData), confidence_score, fields=fields)
+    except Exception as e:
+        print(f"An unexpected error occurred for {docNames}: {e}")
         continue
 
-    response = textract.analyze_document(
-    Document={'S3Object': {'Bucket': 'capstone-intelligent-document-processing', 'Name': (docNames)}},
-    FeatureTypes=["QUERIES"],
-    QueriesConfig={"Queries": [
-    {"Text": "What is the Member Name", "Alias": "MEMBER_NAME"},
-    {"Text": "What is the Member ID?", "Alias": "MEMBER_ID"},
-    {"Text": "Who is the PCP?", "Alias": "PCP"},
-    {"Text": "What is the phone number of the PCP?", "Alias": "PCP_PHONE"},
-    {"Text": "What is the medical insurance provider?", "Alias": "MEDICAL_PROVIDER"},
-    {"Text": "What is the effective date?", "Alias": "EFFECTIVE_DATE"},
-    {"Text": "What is the Group No.?", "Alias": "GROUP_NUMBER"},
-    {"Text": "What is the plan type?", "Alias": "PLAN_TYPE"},
-    {"Text": "What is the BIN?", "Alias": "BIN"},
-    {"Text": "What is the Rx PCN?", "Alias": "RX-PCN"},
-    {"Text": "What is the Generic Copay?", "Alias": "GENERIC_COPAY"},
-    {"Text": "What is the Brand Copay?", "Alias": "BRAND_COPAY"},
-    {"Text": "What is the Specialty Copay?", "Alias": "SPECIALTY_COPAY"},
-    {"Text": "What is the Emergency Room Percentage?", "Alias": "EMERGENCY_ROOM_PERCENTAGE"},
-    {"Text": "What is the PCP Copay?", "Alias": "PCP_COPAY"}
-    ]}
-    )
-
-    d = t2.TDocumentSchema().load(response)
-    page = d.pages[0]
-    query_answers = d.get_query_answers(page=page)
-    count=len(query_answers)
-
-    queryData={}
-    queryData["confidence"]={}
-    queryData["document_data"]={}
-    emptyCount = 0
-    keyCount = 0
-    
-    for i in range(count):
-        (a,b,c) = query_answers[i]
-        a = a.split("the ",1)[1]
-        a = a.split("?",1)[0]
-        queryData["document_data"][a] = c
-
-    for key, value in queryData["document_data"].items():
-        if key:
-            keyCount += 1
-        if value == "":
-            emptyCount += 1
-    
-    confidence_score = (keyCount-emptyCount)/keyCount
-    queryData["confidence"] = {"confidence_score": confidence_score}
-    # countTesting = Counter(queryData.values())# using counter to get number of empty values
-    # countTestingTest = countTesting[""]
-
-    # print(emptyCount)# manually checking how many values are empty
-    # print(keyCount-emptyCount)
-    # print(keyCount)
-    # print(confidence_score)
-
-    print(json.dumps(queryData, indent=4))# checking the output
-
-    # cursor.execute("INSERT INTO insurance1 (document_key, json, confidence_score) VALUES (%s, %s, %s)",(docNames, json.dumps(queryData, indent=4), confidence_score))
-    # connection.commit()
+# Write whatever is still queued, update the per-field view, then release the connections
+if resultSink:
+    resultSink.close()
+if connectionPool:
+    connectionPool.closeall()
+responseArchive.close()
+print(responseArchive.report())
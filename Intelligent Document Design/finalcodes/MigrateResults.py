@@ -0,0 +1,61 @@
+import os
+import psycopg2
+from dotenv import load_dotenv
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedCode.result_schema import convert_to_jsonb, create_json_index, ensure_result_key, rename_document_keys
+from sharedCode.textract_queries import TABLE_REQUESTS, alias_map
+
+# Brings result tables written by older versions of the finalcodes scripts up to date.
+# Every step checks what is already done, so it is safe to run again.
+#  - etag and row_id columns and a unique (document_key, etag) constraint are added for the scripts'
+#    upserts; this runs first, while the rows are still in insertion order, so row_id keeps it
+#  - the json column becomes jsonb (this also drops the indent=4 whitespace from old rows)
+#  - document_data keys change from question text ("Member ID") to query aliases ("MEMBER_ID")
+#  - a GIN index is added so the fields can be searched
+# Old rows keep an empty etag, which the scripts treat as "already processed" for that document.
+
+load_dotenv()
+
+db_endpoint = os.getenv("DB_ENDPOINT")
+db_port = os.getenv("DB_PORT")
+db_name = os.getenv("DB_NAME")
+db_user = os.getenv("DB_USER")
+db_pass = os.getenv("DB_PASS")
+
+# Keys the scripts set themselves rather than through a query
+extraKeys = {
+    "breastpump": {"Physician Signature": "PHYSICIAN_SIGNATURE"},
+}
+# signedagreement already used short keys (name, date, signature)
+tables = list(TABLE_REQUESTS) + ["signedagreement"]
+
+
+def get_db_connection():
+    return psycopg2.connect(host=db_endpoint,
+                            port=db_port,
+                            database=db_name,
+                            user=db_user,
+                            password=db_pass,
+                            sslrootcert="SSLCERTIFICATE")
+
+
+conn = get_db_connection()
+for table in tables:
+    try:
+        if ensure_result_key(conn, table):
+            print(f"{table}: added unique (document_key, etag) constraint")
+        if convert_to_jsonb(conn, table):
+            print(f"{table}: json column converted to jsonb")
+        keyMap = alias_map(TABLE_REQUESTS.get(table, []))
+        keyMap.update(extraKeys.get(table, {}))
+        if keyMap:
+            print(f"{table}: renamed keys in {rename_document_keys(conn, table, keyMap)} rows")
+        create_json_index(conn, table)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Could not migrate {table}: {e}")
+
+conn.close()
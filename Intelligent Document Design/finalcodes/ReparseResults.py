@@ -0,0 +1,93 @@
+import os
+import time
+from dotenv import load_dotenv
+from psycopg2.pool import ThreadedConnectionPool
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedCode.background_writer import BackgroundResultWriter
+from sharedCode.parquet_sink import ParquetResultSink
+from sharedCode.reparse import DATASET_DOC_TYPES, REPARSE_DOC_TYPES, find_reparse_jobs, reparse_documents, result_aliases
+from sharedCode.response_archive import ResponseArchive
+from sharedCode.result_schema import FIELD_TABLE
+from sharedCode.result_sink import PostgresResultSink, SQLiteResultSink
+
+# Re-runs the current extractors (the query-answer mapping, detect_data, extract_information_medical)
+# over the Textract responses the other scripts archived, and upserts the new results.
+# Nothing is read from S3 and Textract is never called, so it is safe to run after any parser change.
+#   python ReparseResults.py                          every doc type whose script stores its results
+#   python ReparseResults.py facesheet breastpump     only these (result table names, or PRESCRIPTION /
+#                                                     SIGNED_AGREEMENT for Ethan_PDFandJPG3's dataset)
+
+load_dotenv()
+
+db_endpoint = os.getenv("DB_ENDPOINT")
+db_port = os.getenv("DB_PORT")
+db_name = os.getenv("DB_NAME")
+db_user = os.getenv("DB_USER")
+db_pass = os.getenv("DB_PASS")
+result_sqlite_path = os.getenv("RESULT_SQLITE_PATH")
+# Worker processes for the extractors (None = one per CPU core, 0 = run in this process)
+reparseWorkers = None
+# Ethan_PDFandJPG3's Parquet dataset, relative to where it was run
+datasetDir = "extracted_documents"
+
+
+def get_db_pool(maxconn):
+    # One connection per result table writer, which borrows it per batch
+    return ThreadedConnectionPool(1, maxconn,
+                                  host=db_endpoint,
+                                  port=db_port,
+                                  database=db_name,
+                                  user=db_user,
+                                  password=db_pass,
+                                  sslrootcert="SSLCERTIFICATE")
+
+
+if __name__ == "__main__":
+    docTypes = sys.argv[1:] or REPARSE_DOC_TYPES
+    unknown = [docType for docType in docTypes if docType not in REPARSE_DOC_TYPES]
+    if unknown:
+        sys.exit(f"Unknown doc types {unknown}; choose from {REPARSE_DOC_TYPES}")
+
+    responseArchive = ResponseArchive()
+    jobs, missing = find_reparse_jobs(responseArchive, docTypes)
+    print(f"{len(jobs)} archived documents to re-parse")
+    if missing:
+        print(f"{len(missing)} documents skipped: not every request's response is archived")
+
+    # Same result tables and upsert on (document_key, etag) as the scripts, so new results replace old ones
+    tableTypes = [docType for docType in docTypes if docType not in DATASET_DOC_TYPES]
+    connectionPool = None if result_sqlite_path or not tableTypes else get_db_pool(len(tableTypes) + 1)
+    resultSinks = {}
+    for docType in tableTypes:
+        if connectionPool:
+            resultStore = PostgresResultSink(None, docType, pool=connectionPool, field_table=FIELD_TABLE)
+        else:
+            resultStore = SQLiteResultSink(result_sqlite_path, docType, field_table=FIELD_TABLE)
+        resultStore.prepare(result_aliases(docType))
+        resultSinks[docType] = BackgroundResultWriter(resultStore)
+    datasetSink = ParquetResultSink(datasetDir) if set(docTypes) & set(DATASET_DOC_TYPES) else None
+
+    start = time.perf_counter()
+    failed = 0
+    for docType, docNames, etag, output, error in reparse_documents(jobs, reparseWorkers):
+        if error:
+            print(f"Could not re-parse {docNames}: {error}")
+            failed += 1
+        elif docType in DATASET_DOC_TYPES:
+            datasetSink.add(docNames, etag, docType, output)
+        else:
+            resultJson, confidence_score, fields = output
+            resultSinks[docType].add(docNames, etag, resultJson, confidence_score, fields=fields)
+
+    # Write whatever is still queued, update the per-field views, then release the connections
+    for resultSink in resultSinks.values():
+        resultSink.close()
+    if datasetSink:
+        datasetSink.close()
+    if connectionPool:
+        connectionPool.closeall()
+    responseArchive.close()
+    elapsed = time.perf_counter() - start
+    print(f"Re-parsed {len(jobs) - failed} documents in {elapsed:.1f}s ({failed} failed)")
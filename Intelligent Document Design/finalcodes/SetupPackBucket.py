@@ -0,0 +1,31 @@
+import os
+import boto3
+from dotenv import load_dotenv
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedCode.page_packing import PACK_EXPIRY_DAYS, ensure_pack_expiry, pack_prefix
+
+# One-time setup of the staging bucket the scripts upload packed PDFs to (TEXTRACT_PACK_BUCKET in .env).
+# Adds a lifecycle rule that deletes anything under TEXTRACT_PACK_PREFIX after PACK_EXPIRY_DAYS, so a pack
+# left behind by a killed run does not stay forever. The bucket's other rules are kept, and running it
+# again changes nothing. Needs s3:GetLifecycleConfiguration and s3:PutLifecycleConfiguration, which the
+# pipeline's own credentials do not need; if infrastructure manages the bucket, add the rule there instead.
+
+load_dotenv()
+
+aws_access_key_id = os.getenv("AWS_ACCESS_KEY_ID")
+aws_secret_access_key = os.getenv("AWS_SECRET_ACCESS_KEY")
+pack_bucket = os.getenv("TEXTRACT_PACK_BUCKET")
+
+if not pack_bucket:
+    sys.exit("Set TEXTRACT_PACK_BUCKET in .env to the staging bucket first")
+
+s3 = boto3.client('s3',
+                  aws_access_key_id=aws_access_key_id,
+                  aws_secret_access_key=aws_secret_access_key)
+
+if ensure_pack_expiry(s3, pack_bucket, pack_prefix()):
+    print(f"{pack_bucket}: objects under {pack_prefix()} now expire after {PACK_EXPIRY_DAYS} day(s)")
+else:
+    print(f"{pack_bucket}: the pack expiry rule is already there")
@@ -1,16 +1,28 @@
 import os
 import boto3
 import botocore
-import json
 from dotenv import load_dotenv
 from textractcaller.t_call import call_textract
 from textractprettyprinter.t_pretty_print import (Textract_Pretty_Print, get_string)
 import trp.trp2 as t2
 from tabulate import tabulate
-import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 from collections import Counter
 import time
-import re
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedCode.agreement_fields import parse_agreement_blocks
+from sharedCode.background_writer import BackgroundResultWriter
+from sharedCode.document_object import DocumentObject
+from sharedCode.json_codec import dumps_compact
+from sharedCode.page_packing import is_pack_key
+from sharedCode.page_render import analyze_pages_sync, pdf_page_count, render_pdf_pages
+from sharedCode.preflight import preflight_object
+from sharedCode.response_archive import ResponseArchive, request_fingerprint
+from sharedCode.result_schema import FIELD_TABLE
+from sharedCode.result_sink import PostgresResultSink, SQLiteResultSink
+from sharedCode.textract_queries import SIGNED_AGREEMENT_REQUESTS
 
 load_dotenv()
 
@@ -23,7 +35,12 @@ db_port = os.getenv("DB_PORT")
 db_name = os.getenv("DB_NAME")
 db_user = os.getenv("DB_USER")
 db_pass = os.getenv("DB_PASS")
+result_sqlite_path = os.getenv("RESULT_SQLITE_PATH")
 maxSize = 10*1024*1024
+# PDFs with at most this many pages are rendered locally and sent through the synchronous API (0 = always use async jobs)
+syncPageLimit = 3
+# Analyze arguments for both the synchronous and the async path
+agreementRequest = SIGNED_AGREEMENT_REQUESTS[0]
 
 
 s3 = boto3.client('s3',
@@ -41,6 +58,7 @@ def getObjectNames(bucket_name):
     page_iterator = paginator.paginate(**operation_parameters)
 
     object_keys = []
+    etags = {}
     page_iterator = iter(page_iterator)
 
     #if want to run this on a specific range of documents, use the code below and adjust page to
@@ -51,136 +69,104 @@ def getObjectNames(bucket_name):
     # if page and 'Contents' in page:
     #     for item in page['Contents']:
     #         object_keys.append(item['Key'])
+    #         etags[item['Key']] = item['ETag'].strip('"')
     #         if len(object_keys) >= 7:
     #             break
-    # return object_keys
+    # return object_keys, etags
 
     #code below runs it on the entire database
 
     for page in page_iterator:
         if 'Contents' in page:
             for item in page['Contents']:
+                # Packed PDFs staged for Textract are not documents
+                if is_pack_key(item['Key']):
+                    continue
                 object_keys.append(item['Key'])
-    return object_keys
-
-def get_db_connection():
-    return psycopg2.connect(host=db_endpoint,
-                            port=db_port,
-                            database=db_name,
-                            user=db_user,
-                            password=db_pass,
-                            sslrootcert="SSLCERTIFICATE")
-
-def detect_data(blocks):
-    dataResults = {}
-    dataResults["confidence"] = {}
-    dataResults["document_data"] = {
-        "name": "",
-        "date": "",
-    }
-
-    for block in blocks:
-        if block.get("BlockType") == "SIGNATURE":
-            dataResults["document_data"]["signature"] = ("Present")
-
-        if block.get("BlockType") == "LINE":
-            text = block.get("Text", "")
-            if "Signed by customer:" in text or "Firmado por el cliente:" in text:
-                parts = text.split(":", 1)
-                if len(parts) > 1:
-                    name = parts[1].strip()
-                    dataResults["document_data"]["name"] = name
-                else:
-                    dataResults["document_data"]["name"] = ""
-
-            if "Date" in text or "Fecha" in text:
-                date_match = re.search(r"(Date|Fecha)\s*[:]?\s*(\d{2}/\d{2}/\d{4} \d{2}:\d{2} CMT)", text)
-                if date_match:
-                    date = date_match.group(2).strip()
-                    dataResults["document_data"]["date"] = date
-                else:
-                    dataResults["document_data"]["date"] = ""
-    return dataResults
-
-testing = getObjectNames(bucket_name)
-connection = get_db_connection()
-cursor = connection.cursor()
+                etags[item['Key']] = item['ETag'].strip('"')
+    return object_keys, etags
+
+def get_db_pool():
+    # Connections for the background result writer, which borrows one per batch
+    return ThreadedConnectionPool(1, 2,
+                                  host=db_endpoint,
+                                  port=db_port,
+                                  database=db_name,
+                                  user=db_user,
+                                  password=db_pass,
+                                  sslrootcert="SSLCERTIFICATE")
+
+def analyze_agreement(docNames, pageCount=None):
+    # Short PDFs skip the async job and its polling: each page is rendered to a PNG and
+    # analyzed with a synchronous request, all pages in parallel
+    if syncPageLimit and (pageCount is None or pageCount <= syncPageLimit):
+        with DocumentObject(s3, bucket_name, docNames) as document:
+            if pdf_page_count(document.open()) <= syncPageLimit:
+                pageImages = render_pdf_pages(document.open())
+                return analyze_pages_sync(textract, pageImages, **agreementRequest)["Blocks"]
+
+    response = textract.start_document_analysis(
+    DocumentLocation={'S3Object': {'Bucket': 'capstone-intelligent-document-processing', 'Name': (docNames)}},
+    **agreementRequest
+    )
+
+    job_id = response['JobId']
+    while True:
+        result = textract.get_document_analysis(JobId=job_id)
+        if result["JobStatus"] in ["SUCCEEDED", "FAILED"]:
+            break
+        time.sleep(2)
+
+    all_blocks = []
+    next_token = None
+
+    while True:
+        if next_token:
+            result = textract.get_document_analysis(JobId=job_id, NextToken=next_token)
+        else:
+            result = textract.get_document_analysis(JobId=job_id)
+
+        all_blocks.extend(result['Blocks'])
+        next_token = result.get('NextToken')
+        if not next_token:
+            break
+    return all_blocks
+
+testing, etags = getObjectNames(bucket_name)
+# Results go to Postgres, or to a local SQLite file when RESULT_SQLITE_PATH is set (runs without a database server)
+connectionPool = None if result_sqlite_path else get_db_pool()
+if connectionPool:
+    resultStore = PostgresResultSink(None, "signedagreement", pool=connectionPool, field_table=FIELD_TABLE)
+else:
+    resultStore = SQLiteResultSink(result_sqlite_path, "signedagreement", field_table=FIELD_TABLE)
+resultStore.prepare(["name", "date", "signature"])
+# Documents whose current version is already stored are skipped before any S3 or Textract call,
+# so a rerun only pays for new or changed objects
+testing = resultStore.unprocessed(testing, etags)
+print(f"{len(testing)} documents to process")
+# Rows are written in batches (one INSERT and commit per batch) on a background thread,
+# so the Textract loop never waits on the database
+resultSink = BackgroundResultWriter(resultStore)
+# Every Textract response is kept (compressed, by ETag and request) so the results can be
+# re-parsed later without calling Textract again
+responseArchive = ResponseArchive()
+agreementFingerprint = request_fingerprint(agreementRequest)
 
 for index, docNames in enumerate(testing):
     print(index)
-    sizeCheck = s3.head_object(Bucket=bucket_name, Key=docNames)
-    size = sizeCheck['ContentLength']
-
-    if not docNames.endswith(".pdf"):
-        continue
-
-    if size > maxSize:
-        continue
-
-    if "026fc6e3b3eb47b9894ccb490be6885c_OUT_PATIENT_2024_07_13_07_04_56_0e6c137980dd4f789d6793b35f8172eb_INSURANCECARD_capturepng.null.png" in docNames:
+    # One ranged GET gives the real format and size, so files Textract would reject never reach it
+    preflight = preflight_object(s3, bucket_name, docNames, ("pdf",), maxSize)
+    if preflight["reason"]:
+        print(f"Skipping {docNames}: {preflight['reason']}")
         continue
 
     try:
-        response = textract.start_document_analysis(
-        DocumentLocation={'S3Object': {'Bucket': 'capstone-intelligent-document-processing', 'Name': (docNames)}},
-        FeatureTypes=["FORMS", "SIGNATURES"]
-        )
+        all_blocks = analyze_agreement(docNames, preflight["page_count"])
+        responseArchive.put(docNames, etags[docNames], agreementFingerprint, {"Blocks": all_blocks}, "signedagreement")
 
-        job_id = response['JobId']
-        while True:
-            result = textract.get_document_analysis(JobId=job_id)
-            if result["JobStatus"] in ["SUCCEEDED", "FAILED"]:
-                break
-            time.sleep(2)
-        
-        all_blocks = []
-        next_token = None
-        first_page_metadata = None
-
-        while True:
-            if next_token:
-                result = textract.get_document_analysis(JobId=job_id, NextToken=next_token)
-            else:
-                result = textract.get_document_analysis(JobId=job_id)
-                first_page_metadata = result.get("DocumentMetadata")
-        
-            all_blocks.extend(result['Blocks'])
-            next_token = result.get('NextToken')
-            if not next_token:
-                break
-
-        full_response = {
-            "Blocks": all_blocks,
-            "DocumentMetadata": first_page_metadata if first_page_metadata else {},
-            "JobStatus": response.get("JobStatus", "UNKNOWN")
-        }
-
-        queryData={}
-        queryData["confidence"]={}
-        queryData["document_data"]={}
-        emptyCount = 0
-        keyCount = 0
-        
-        queryData = detect_data(all_blocks)
-        for key, value in queryData["document_data"].items():
-            if key:
-                keyCount += 1
-            if value == "":
-                emptyCount += 1
-        
-        confidence_score = (keyCount-emptyCount)/keyCount
-        queryData["confidence"] = {"confidence_score": confidence_score}
-        # print(json.dumps(queryData, indent=4))
-
-        # print(emptyCount)# manually checking how many values are empty
-        # print(keyCount-emptyCount)
-        # print(keyCount)
-        # print(confidence_score)
-
-        # print(json.dumps(queryData, indent=4))# checking the output
-
-        cursor.execute("INSERT INTO signedagreement (document_key, json, confidence_score) VALUES (%s, %s, %s)",(docNames, json.dumps(queryData, indent=4), confidence_score))
-        connection.commit()
+        # Fields read from the blocks, the share found, and the rows for the field table
+        queryData, confidence_score, fields = parse_agreement_blocks(all_blocks)
+        resultSink.add(docNames, etags[docNames], dumps_compact(queryData), confidence_score, fields=fields)
     except textract.exceptions.UnsupportedDocumentException as e:
         print(f"Unsupported document format for file: {docNames}, skipping.")
         continue
@@ -192,3 +178,10 @@ for index, docNames in enumerate(testing):
     except Exception as e:
         print(f"An unexpected error occurred for {docNames}: {e}")
         continue
+
+# Write whatever is still queued, update the per-field view, then release the connections
+resultSink.close()
+if connectionPool:
+    connectionPool.closeall()
+responseArchive.close()
+print(responseArchive.report())
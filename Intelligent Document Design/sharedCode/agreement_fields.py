@@ -0,0 +1,63 @@
+import re
+
+from sharedCode.spatial_index import build_page_indexes
+
+# "Date: 01/02/2024 10:30 CMT" on one line, and the bare value for labels whose value sits elsewhere
+DATE_PATTERN = re.compile(r"(Date|Fecha)\s*[:]?\s*(\d{2}/\d{2}/\d{4} \d{2}:\d{2} CMT)")
+DATE_VALUE_PATTERN = re.compile(r"\d{2}/\d{2}/\d{4} \d{2}:\d{2} CMT")
+
+
+def detect_data(blocks):
+    # label values that wrap onto the next line are looked up by position instead of by text
+    pageIndexes = build_page_indexes(blocks)
+
+    dataResults = {}
+    dataResults["confidence"] = {}
+    dataResults["document_data"] = {
+        "name": "",
+        "date": "",
+    }
+
+    for block in blocks:
+        if block.get("BlockType") == "SIGNATURE":
+            dataResults["document_data"]["signature"] = ("Present")
+
+        if block.get("BlockType") == "LINE":
+            text = block.get("Text", "")
+            if "Signed by customer:" in text or "Firmado por el cliente:" in text:
+                parts = text.split(":", 1)
+                name = parts[1].strip() if len(parts) > 1 else ""
+                if not name:
+                    valueBlock = pageIndexes[block.get("Page", 1)].find_value(block)
+                    if valueBlock:
+                        name = valueBlock.get("Text", "").strip()
+                dataResults["document_data"]["name"] = name
+
+            if "Date" in text or "Fecha" in text:
+                date_match = DATE_PATTERN.search(text)
+                if date_match:
+                    date = date_match.group(2).strip()
+                    dataResults["document_data"]["date"] = date
+                else:
+                    date = ""
+                    valueBlock = pageIndexes[block.get("Page", 1)].find_value(block)
+                    if valueBlock:
+                        value_match = DATE_VALUE_PATTERN.search(valueBlock.get("Text", ""))
+                        if value_match:
+                            date = value_match.group(0)
+                    dataResults["document_data"]["date"] = date
+    return dataResults
+
+
+def parse_agreement_blocks(blocks):
+    """(result, confidence_score, fields) for one signed agreement, like parse_query_responses
+
+    Fields have no per-field confidence, since they are not query answers.
+    """
+    result = detect_data(blocks)
+    key_count = sum(1 for key in result["document_data"] if key)
+    empty_count = sum(1 for value in result["document_data"].values() if value == "")
+    confidence_score = (key_count - empty_count) / key_count
+    result["confidence"] = {"confidence_score": confidence_score}
+    fields = [(alias, value, None) for alias, value in result["document_data"].items()]
+    return result, confidence_score, fields
@@ -0,0 +1,79 @@
+import atexit
+import queue
+import threading
+import time
+
+# Rows the background writer holds before add() starts blocking the producer
+QUEUE_SIZE = 1000
+
+
+class BackgroundResultWriter:
+    """Runs a result sink on its own thread behind a bounded queue
+
+    add() only enqueues, so the Textract loop never waits on the database or disk
+    unless the queue is full (backpressure). The thread also flushes the sink on
+    its flush_seconds timer when no rows arrive. close() drains the queue, writes
+    the last batch and joins the thread; it also runs at interpreter exit, so a run
+    that crashes or is interrupted still saves what it queued. Errors while the run
+    goes on are printed (the sink keeps rows it could not write and retries them);
+    if the sink's own close() fails, close() raises it.
+
+    The sink needs add(), flush(), close(), flush_seconds, last_flush and a name
+    (its table name for the database sinks).
+    """
+
+    _STOP = object()
+
+    def __init__(self, sink, queue_size=QUEUE_SIZE):
+        self.sink = sink
+        self.name = getattr(sink, "table", None) or sink.name
+        self.queue = queue.Queue(maxsize=queue_size)
+        # Set by the writer thread when the sink's close() fails
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name=f"result-writer-{self.name}", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, *row, **kwargs):
+        """Queue one row (the sink's add() arguments) for the writer thread, blocking only while the queue is full"""
+        if not self.thread.is_alive():
+            raise RuntimeError("Result writer thread has stopped")
+        self.queue.put((row, kwargs))
+
+    def _run(self):
+        while True:
+            wait = max(0.0, self.sink.flush_seconds - (time.monotonic() - self.sink.last_flush))
+            try:
+                item = self.queue.get(timeout=wait)
+            except queue.Empty:
+                self._safely(self.sink.flush)
+                continue
+            if item is self._STOP:
+                break
+            row, kwargs = item
+            self._safely(self.sink.add, *row, **kwargs)
+        try:
+            self.sink.close()
+        except Exception as e:
+            self.error = e
+
+    def _safely(self, method, *args, **kwargs):
+        try:
+            method(*args, **kwargs)
+        except Exception as e:
+            print(f"Result writer for {self.name} hit an error: {e}")
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(self._STOP)
+            self.thread.join()
+        if self.error is not None:
+            # Raised once, not again by the atexit call
+            error, self.error = self.error, None
+            raise RuntimeError(f"Result writer for {self.name} lost rows: {error}") from error
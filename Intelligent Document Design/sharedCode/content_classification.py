@@ -0,0 +1,65 @@
+from sharedCode.text_matching import KeywordScorer
+
+# Keywords for each document type, counted together in one pass over the text
+CONTENT_TYPE_SCORER = KeywordScorer({
+    "prescription": [
+        "prescription", "rx", "physician", "doctor", "diagnosis",
+        "patient name", "mother name", "mother's name", "breast pump",
+        "icd-10", "medical necessity", "dob", "date of birth"
+    ],
+    "agreement": [
+        "agreement", "signature", "signed", "consent", "terms",
+        "conditions", "i agree", "customer", "acknowledge"
+    ],
+    "insurance": [
+        "insurance", "member", "policy", "group", "copay", "deductible",
+        "plan", "coverage", "id#", "id #", "insured", "subscriber"
+    ]
+})
+
+# Scores only grow as pages are read and INSURANCE_CARD wins over every other type, so once the
+# pages so far give it no later page can change the type. Any other type can still be overridden
+# (by insurance keywords, or by the other type's count overtaking it), so those read every page.
+FINAL_DOCUMENT_TYPES = ("INSURANCE_CARD",)
+
+
+def classify_content_scores(scores):
+    """Turn keyword scores into a (document type, confidence) pair"""
+    prescription_count = scores["prescription"]
+    agreement_count = scores["agreement"]
+    insurance_count = scores["insurance"]
+
+    # Document is classified based on which type has more keyword matches
+    if insurance_count >= 2:
+        # Insurance cards take precedence to avoid misclassification
+        return "INSURANCE_CARD", insurance_count
+    elif prescription_count >= 3 and prescription_count > agreement_count:
+        return "PRESCRIPTION", prescription_count
+    elif agreement_count >= 3 and agreement_count >= prescription_count:
+        return "SIGNED_AGREEMENT", agreement_count
+    elif prescription_count >= 2:
+        return "POSSIBLE_PRESCRIPTION", prescription_count
+    elif agreement_count >= 2:
+        return "POSSIBLE_AGREEMENT", agreement_count
+    else:
+        return "UNKNOWN", 0
+
+
+def classify_pages(page_texts, stop_early=True):
+    """Classify a document from its page texts, read lazily; returns (result, pages read, any text found)
+
+    With stop_early, reading stops at the first page that makes the type final
+    (FINAL_DOCUMENT_TYPES); the document type is then the same as reading every page.
+    """
+    matched = set()
+    pages_read = 0
+    has_text = False
+    result = ("UNKNOWN", 0)
+    for page_text in page_texts:
+        pages_read += 1
+        has_text = has_text or bool(page_text)
+        matched |= CONTENT_TYPE_SCORER.matched(page_text)
+        result = classify_content_scores(CONTENT_TYPE_SCORER.scores_for(matched))
+        if stop_early and result[0] in FINAL_DOCUMENT_TYPES:
+            break
+    return result, pages_read, has_text
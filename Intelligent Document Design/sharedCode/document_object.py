@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+
+from sharedCode.object_download import download_verified
+
+# Objects larger than this are spooled to a temp file instead of being held in memory
+SPILL_THRESHOLD = 8 * 1024 * 1024
+
+
+class DocumentObject:
+    """Bytes of one S3 object, downloaded at most once and shared by every stage that reads it
+
+    Use one per document with a with-block; the bytes (or the temp file they were
+    spilled to) are released when the block exits. Nothing is downloaded until a
+    stage actually asks for the bytes. With a LocalObjectCache the bytes are read
+    from (and kept in) the on-disk cache instead, so a re-run skips the download.
+    """
+
+    def __init__(self, s3_client, bucket, key, spill_threshold=SPILL_THRESHOLD, cache=None, etag=None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.spill_threshold = spill_threshold
+        self.cache = cache
+        self.etag = etag
+        self.download_count = 0
+        self._file = None
+        self._path = None
+        self._cache_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _fetch(self):
+        if self.cache is not None:
+            self._cache_path = self.cache.get_path(self.bucket, self.key, self.etag)
+            self._file = open(self._cache_path, 'rb')
+            return
+        spooled = tempfile.SpooledTemporaryFile(max_size=self.spill_threshold)
+        try:
+            download_verified(self.s3_client, self.bucket, self.key, spooled, self.etag)
+        except Exception:
+            spooled.close()
+            raise
+        self.download_count += 1
+        self._file = spooled
+
+    def open(self):
+        """Return a seekable binary file positioned at the start of the object"""
+        if self._file is None:
+            self._fetch()
+        self._file.seek(0)
+        return self._file
+
+    def read_bytes(self):
+        """Return the whole object as bytes, for APIs that need bytes rather than a file"""
+        return self.open().read()
+
+    def path(self):
+        """Return a path to a file holding the bytes, for handing the object to another process"""
+        if self._path is None:
+            if self.cache is not None:
+                self.open()
+                return self._cache_path
+            source = self.open()
+            suffix = os.path.splitext(self.key)[1]
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+            self._path = target.name
+        return self._path
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._path is not None:
+            os.remove(self._path)
+            self._path = None
@@ -0,0 +1,13 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # the standard library encoder gives the same output, only slower
+    orjson = None
+
+
+def dumps_compact(data):
+    """Serialize a result for a jsonb column or an NDJSON line: no indentation or spaces after separators"""
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
@@ -0,0 +1,45 @@
+from sharedCode.page_arrays import build_page_arrays, near_label_mask, signature_line_mask, text_mask
+from sharedCode.text_matching import KeywordSet
+
+SIGNATURE_LABELS = KeywordSet(["signature", "signed by", "firma", "firmado por"])
+SIGNATURE_INDICATORS = ["signature", "signed", "/s/"]
+
+
+def is_signature_label(text):
+    return SIGNATURE_LABELS.contains_any(text.lower())
+
+
+def detect_signature(response):
+    """True when a response has a SIGNATURE block, signature text, or a wide, short
+    LINE to the right of or just below a signature label (e.g. "Signature:", "Firma")"""
+    try:
+        blocks = response.get('Blocks', [])
+
+        # Method 1: Check for SIGNATURE block type
+        for block in blocks:
+            if block.get('BlockType') == 'SIGNATURE':
+                print("Signature detected via SIGNATURE block type")
+                return True
+
+        # Method 2: Look for signature-shaped lines next to a signature label
+        for arrays in build_page_arrays(blocks).values():
+            labels = text_mask(arrays, is_signature_label)
+            if not labels.any():
+                continue
+            if near_label_mask(arrays, labels, candidate_mask=signature_line_mask(arrays)).any():
+                print("Possible signature detected via geometry analysis")
+                return True
+
+        # Method 3: Check for specific text indicators
+        all_text = ' '.join([block.get('Text', '').lower() for block in blocks if 'Text' in block])
+        for indicator in SIGNATURE_INDICATORS:
+            if indicator in all_text:
+                print(f"Signature presence inferred from text: '{indicator}'")
+                return True
+
+        print("No signatures detected.")
+        return False
+
+    except Exception as e:
+        print(f"Error in signature detection: {e}")
+        return False
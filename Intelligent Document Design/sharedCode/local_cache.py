@@ -0,0 +1,85 @@
+import os
+import tempfile
+
+from sharedCode.object_download import download_verified
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'valere-ocr', 'objects')
+DEFAULT_MAX_MB = 2048
+
+
+class LocalObjectCache:
+    """Size-limited cache of S3 objects on local disk, addressed by ETag
+
+    A file is stored as <ETag><extension>, so a changed object (new ETag) never
+    matches an old file and stale bytes are never served. When the cache grows past
+    max_bytes the least recently used files are deleted; a hit refreshes the file's
+    modification time. Location and size come from OBJECT_CACHE_DIR and
+    OBJECT_CACHE_MAX_MB in .env when not given.
+    """
+
+    def __init__(self, s3_client, cache_dir=None, max_bytes=None):
+        self.s3_client = s3_client
+        self.cache_dir = cache_dir or os.getenv("OBJECT_CACHE_DIR") or DEFAULT_CACHE_DIR
+        if max_bytes is None:
+            max_bytes = int(os.getenv("OBJECT_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path_for(self, key, etag):
+        extension = os.path.splitext(key)[1].lower()
+        return os.path.join(self.cache_dir, etag.strip('"') + extension)
+
+    def cached_path(self, key, etag):
+        """Local path of this object version if it is already cached, else None (never downloads)"""
+        path = self._path_for(key, etag)
+        return path if os.path.exists(path) else None
+
+    def get_path(self, bucket, key, etag=None):
+        """Return a local path holding the current version of the object
+
+        Pass the ETag from a listing to skip the HEAD request used to validate it.
+        """
+        if etag is None:
+            etag = self.s3_client.head_object(Bucket=bucket, Key=key)['ETag']
+        path = self._path_for(key, etag)
+
+        if os.path.exists(path):
+            os.utime(path)
+            return path
+
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.part')
+        try:
+            # Checked against the ETag while it streams in, so a corrupt copy is never cached
+            with os.fdopen(fd, 'wb') as temp_file:
+                download_verified(self.s3_client, bucket, key, temp_file, etag)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        """Delete least recently used files until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file() or entry.name.endswith('.part'):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,406 @@
+"""Field extraction for prescriptions and signed agreements from FORMS/TABLES/SIGNATURES responses
+
+Works on a Textract response alone (plus the PDF's own text when there is one),
+so the same code serves live runs and re-parses of archived responses.
+"""
+import re
+
+from sharedCode.kv_resolution import resolve_kv_map
+from sharedCode.layout_heuristics import detect_signature
+from sharedCode.text_matching import KeywordSet, KeywordScorer, PatternMatcher
+
+
+def structure_text(response):
+    # Extract the text from the Textract response dictionary
+    text = ""
+    blocks = response.get('Blocks', [])
+    
+    # Iterate over the blocks to extract text
+    for block in blocks:
+        if block['BlockType'] == 'WORD' or block['BlockType'] == 'LINE':
+            text += block.get('Text', '') + '\n'
+    
+    # Split the text into sections based on the '\n' character
+    sections = {}
+    current_section = None
+
+    for line in text.split('\n'):
+        if line.strip() == "":
+            current_section = None
+        elif line.isupper():
+            current_section = line
+            sections[current_section] = []
+        elif current_section:
+            sections[current_section].append(line)
+        else:
+            current_section = "PARAGRAPH"
+            if current_section not in sections:
+                sections[current_section] = []
+            sections[current_section].append(line)
+
+    for section, content in sections.items():
+        sections[section] = ' '.join(content).strip()
+
+    return sections, text
+
+
+# Keyword lists and patterns are compiled once at import and shared by every document
+SKIPPED_KEY_TERMS = KeywordSet(["icd", "z39", "lactating"])
+PATIENT_KEY_TERMS = KeywordSet(["mother", "infant", "patient", "name", "dob", "date of birth", "phone"])
+DOCTOR_KEY_TERMS = KeywordSet(["physician", "doctor", "md", "prescribing"])
+PUMP_TERMS = KeywordSet(["breast pump", "double electric", "double-electric", "electric breast pump"])
+
+# Common patterns for patient details, as (field name, regex)
+PATIENT_FIELD_PATTERNS = PatternMatcher([
+    ("Patient Name", r"(?:Mother|Patient)\s*Name[:\s]+([^:\n]+)"),
+    ("Date of Birth", r"(?:Mother|Patient)?\s*Date of [Bb]irth[:\s]+([^:\n]+)"),
+    ("DOB", r"(?:Mother|Patient)?\s*DOB[:\s]+([^:\n]+)"),
+    ("Phone Number", r"(?:Mother|Patient)?\s*Phone\s*(?:Number)?[:\s]+([^:\n]+)"),
+    ("Infant Name", r"(?:Infant|Baby)\s*Name[:\s]+([^:\n]+)"),
+    ("Infant Date of Birth", r"(?:Infant|Baby)\s*Date of [Bb]irth[:\s]+([^:\n]+)"),
+    ("EDD", r"EDD[:\s]+([^:\n]+)")
+])
+
+AGREEMENT_DATE_PATTERNS = PatternMatcher([
+    ("Date", r"Date\s*:\s*(\d{2}/\d{2}/\d{4})"),
+    ("Date", r"Fecha\s*:\s*(\d{2}/\d{2}/\d{4})"),
+    ("Date", r"(\d{2}/\d{2}/\d{4})")
+])
+
+AGREEMENT_NAME_PATTERNS = PatternMatcher([
+    ("Name", r"Signed by customer\s*:\s*([^\n\.;,]+)"),
+    ("Name", r"Signed by\s*:\s*([^\n\.;,]+)"),
+    ("Name", r"Customer\s*:\s*([^\n\.;,]+)"),
+    ("Name", r"Patient\s*:\s*([^\n\.;,]+)"),
+    ("Name", r"Name\s*:\s*([^\n\.;,]+)")
+])
+
+# List of phrases to exclude as false positives
+EXCLUDED_NAME_PHRASES = KeywordSet([
+    "to be", "the ", "please", "notify", "customer rights",
+    "submit", "have the right", "fully informed",
+    "contact", "patient's", "if you", "thank you"
+])
+
+
+def extract_information_medical(response, pdf_text=None):
+    patient_info = {}
+    doctor_info = {}
+    prescription_info = {}
+
+    blocks = response.get('Blocks', [])
+    if not blocks:
+        raise ValueError("No blocks found in Textract response")
+
+    # Extract text from all LINE blocks to help with pattern matching
+    all_lines = []
+    for block in blocks:
+        if block['BlockType'] == 'LINE' and 'Text' in block:
+            all_lines.append(block['Text'])
+    all_text = "\n".join(all_lines)
+
+    # Use PyPDF2 extracted text if available (helpful for certain PDF formats)
+    if pdf_text:
+        print("Using PyPDF2 extracted text for additional analysis")
+        all_text += "\n" + pdf_text
+
+    # Get Key-Value pairs
+    kvs = resolve_kv_map(blocks)
+
+    # Check for document format - Texas Children's Hospital or Breast Pump Depot
+    is_texas_childrens = "Texas Children's Hospital" in all_text
+    is_breast_pump_depot = "The Breast Pump Depot" in all_text
+    
+    # Process key-value pairs for patient and doctor information
+    for key, value in kvs.items():
+        key_lower = key.lower()
+        # Skip any fields containing ICD codes or Z39.1
+        if SKIPPED_KEY_TERMS.contains_any(key_lower):
+            continue
+            
+        if PATIENT_KEY_TERMS.contains_any(key_lower):
+            patient_info[key] = value
+        elif DOCTOR_KEY_TERMS.contains_any(key_lower):
+            doctor_info[key] = value
+
+    # Extract patient information through pattern matching in one pass over all_text
+    for field_name, match in PATIENT_FIELD_PATTERNS.first_matches(all_text).items():
+        patient_info[field_name] = match.strip()
+    
+    # Look for breast pump mentions
+    if PUMP_TERMS.contains_any(all_text.lower()):
+        prescription_info["Prescription"] = "Double Electric Breast Pump"
+
+    # Clean up data by removing duplicates and empty values
+    patient_info = {k.replace(":", "").strip(): v for k, v in patient_info.items() if v and v.strip()}
+    doctor_info = {k.replace(":", "").strip(): v for k, v in doctor_info.items() if v and v.strip()}
+    prescription_info = {k.replace(":", "").strip(): v for k, v in prescription_info.items() if v and v.strip()}
+
+    # ADDITIONAL CLEANUP BEFORE RETURNING
+    
+    # 1. Remove unwanted fields completely
+    unwanted_fields = [
+        "Mother expects regular separation from infant",
+        "Mother expects regular",
+        "Care of the lactating mother",
+        "Z39.1",
+        "ICD-10"
+    ]
+    
+    for field_pattern in unwanted_fields:
+        for key in list(patient_info.keys()):
+            if field_pattern in key:
+                del patient_info[key]
+    
+    # 2. Move physician info from patient to doctor section
+    for key in list(patient_info.keys()):
+        if "physician" in key.lower() or "doctor" in key.lower():
+            doctor_value = patient_info[key]
+            if "Doctor Name" not in doctor_info:
+                doctor_info["Doctor Name"] = doctor_value
+            del patient_info[key]
+    
+    # 3. Reorganize infant information into patient section
+    infant_info = {}  # Temporary holder for infant data
+    
+    # Extract infant data from patient section
+    for key in list(patient_info.keys()):
+        if "infant" in key.lower() or "baby" in key.lower():
+            value = patient_info[key]
+            clean_key = key.replace("Infant ", "").replace("Baby ", "")
+            infant_info[clean_key] = value
+            del patient_info[key]
+    
+    # Add infant data to patient section with clear labeling
+    if infant_info:
+        for key, value in infant_info.items():
+            patient_info[f"Infant {key}"] = value
+    
+    # 4. Fix standard field names and apply cleaning rules
+    field_preferences = {
+        "Patient Name": ["Name"],
+        "DOB": ["Date of Birth"],
+        "Phone Number": ["Phone"]
+    }
+    
+    for standard, aliases in field_preferences.items():
+        if standard in patient_info:
+            # Remove aliases if the standard field exists
+            for alias in aliases:
+                if alias in patient_info:
+                    del patient_info[alias]
+    
+    # 5. Clean up the X values in doctor_info
+    for key, value in list(doctor_info.items()):
+        if value == "X":
+            # Replace X with "Selected" for clarity
+            doctor_info[key] = "Selected"
+    
+    # 6. Fix MD signature if it's just a single character (likely misread)
+    if "MD Signature" in doctor_info and len(doctor_info["MD Signature"]) <= 1:
+        doctor_info["MD Signature"] = "Present"
+    
+    # 7. Remove MD Signature field as it's redundant with Physician Signature
+    if "MD Signature" in doctor_info and "Physician Signature" in doctor_info:
+        del doctor_info["MD Signature"]
+    
+    # 8. Extract Doctor Name and NPI from combined fields
+    for key, value in list(doctor_info.items()):
+        # Look for pattern like "Doctor Name, MD - NPI_NUMBER"
+        doctor_npi_match = re.search(r"(.+?),?\s+MD\s+-\s+(\d+)", key)
+        if doctor_npi_match:
+            doctor_name = doctor_npi_match.group(1).strip()
+            npi_number = doctor_npi_match.group(2).strip()
+            
+            # Add new fields
+            doctor_info["Doctor Name"] = doctor_name
+            doctor_info["NPI"] = npi_number
+            
+            # If the original field was selected, note that
+            if value == "Selected":
+                doctor_info["Selected"] = "Yes"
+                
+            # Remove the original combined field
+            del doctor_info[key]
+
+    # 9. Split Patient Name into First Name and Last Name with handling for "Last, First" format
+    if "Patient Name" in patient_info:
+        full_name = patient_info["Patient Name"].strip()
+        
+        # Check if name is in "Last, First" format
+        if "," in full_name:
+            # Split by comma and handle "Last, First" format
+            parts = full_name.split(",", 1)
+            if len(parts) == 2:
+                last_name = parts[0].strip()
+                first_name = parts[1].strip()
+                patient_info["First Name"] = first_name
+                patient_info["Last Name"] = last_name
+                del patient_info["Patient Name"]
+        else:
+            # Handle normal "First Last" format
+            name_parts = full_name.split()
+            if len(name_parts) >= 2:
+                patient_info["First Name"] = name_parts[0]
+                patient_info["Last Name"] = ' '.join(name_parts[1:])
+                del patient_info["Patient Name"]
+            elif len(name_parts) == 1:
+                patient_info["First Name"] = name_parts[0]
+                patient_info["Last Name"] = ""
+                del patient_info["Patient Name"]
+    
+    # 10. Also check existing First/Last name for comma pattern
+    if "First Name" in patient_info and "Last Name" in patient_info:
+        first_name = patient_info["First Name"]
+        last_name = patient_info["Last Name"]
+        
+        # If first name ends with comma, it's likely "Last, First" format
+        if first_name.endswith(","):
+            # Swap First and Last name
+            patient_info["First Name"] = last_name
+            patient_info["Last Name"] = first_name.rstrip(",")
+            
+    # 11. Rename "Selected" to more descriptive "Is Prescribing Physician"
+    if "Selected" in doctor_info:
+        doctor_info["Is Prescribing Physician"] = doctor_info["Selected"]
+        del doctor_info["Selected"]
+
+    # 12. Replace OCR-interpreted signature text with "Present"
+    if "Physician Signature" in doctor_info:
+        doctor_info["Physician Signature"] = "Present"
+        
+    # 13. Fix issue with "Infant Name" containing "Infant Date of Birth"
+    if "Infant Name" in patient_info and patient_info["Infant Name"] == "Infant Date of Birth":
+        patient_info["Infant Name"] = "Not present"
+    
+    # Return the cleaned data
+    return {
+        "patient": patient_info,
+        "doctor": doctor_info,
+        "prescription": prescription_info
+    }
+
+
+def extract_information_signed_agreement(response, pdf_text, object_key):
+    # Initialize with default "Not present" values
+    agreement_info = {
+        "Customer/Patient Name": "Not present",
+        "Date": "Not present",
+        "Signature Present": "No"
+    }
+    
+    # Try to extract date from the PDF text only (not from filename)
+    if pdf_text:
+        for _, match in AGREEMENT_DATE_PATTERNS.iter_matches(pdf_text):
+            date = match.strip()
+            if len(date) == 10:  # Reasonable date length
+                agreement_info["Date"] = date
+                print(f"Found date from PDF: {date}")
+                break
+    
+    # Try to extract customer name from the PDF text
+    if pdf_text:
+        for _, match in AGREEMENT_NAME_PATTERNS.iter_matches(pdf_text):
+            name = match.strip()
+            # More stringent name validation
+            if (len(name) > 2 and len(name) < 50 and
+                not EXCLUDED_NAME_PHRASES.contains_any(name.lower())):
+                agreement_info["Customer/Patient Name"] = name
+                print(f"Found customer name from PDF: {name}")
+                break
+    
+    # Detect signature
+    signature_present = detect_signature(response)
+    agreement_info["Signature Present"] = "Yes" if signature_present else "No"
+    
+    # Return the simple, flat structure matching the example
+    return agreement_info
+
+
+# Keywords used to choose between the medical and agreement extractors
+EXTRACTOR_TYPE_SCORER = KeywordScorer({
+    "prescription": ["prescription", "breast pump", "mother", "infant", "physician", "doctor", "medical necessity"],
+    "agreement": ["agreement", "signed", "consent", "signature", "acknowledge"]
+})
+
+
+def extract_document_info(textract_response, pdf_text=None, object_key=None):
+    """Pick the medical or agreement extractor from the response text and return its cleaned fields"""
+    # Get structured text
+    structured_text, full_text = structure_text(textract_response)
+    
+    first_line = full_text.split('\n')[0].strip() if full_text else "No Label Found"
+    
+    # Determine document type based on content
+    scores = EXTRACTOR_TYPE_SCORER.score(full_text)
+    prescription_score = scores["prescription"]
+    agreement_score = scores["agreement"]
+    
+    extracted_info = {}
+    
+    # Process as appropriate type based on content
+    if prescription_score > agreement_score:
+        # Process as medical document with pdf_text when available
+        medical_info = extract_information_medical(textract_response, pdf_text)
+        
+        # Add the label to the extracted information
+        extracted_info = {
+            "document_label": first_line,
+            "data": {
+                "patient": medical_info["patient"],
+                "doctor": medical_info["doctor"]
+            }
+        }
+        
+        # Additional cleanup for Breast Pump Depot format
+        if "The Breast Pump Depot" in first_line:
+            patient_info = extracted_info["data"]["patient"]
+            doctor_info = extracted_info["data"]["doctor"]
+            
+            # Move physician name to doctor section if it's in patient section
+            if "Physician Name" in patient_info:
+                doctor_info["Doctor Name"] = patient_info["Physician Name"]
+                del patient_info["Physician Name"]
+            
+            # Move Physician NPI to standardized format
+            if "Physician NPI" in doctor_info:
+                doctor_info["NPI"] = doctor_info["Physician NPI"]
+                del doctor_info["Physician NPI"]
+            
+            # Remove duplicate fields in patient info
+            if "First Name" in patient_info and "Last Name" in patient_info:
+                # If we already have First/Last name, remove Mother Name
+                if "Mother Name" in patient_info:
+                    del patient_info["Mother Name"]
+            
+            # Handle date of birth fields - convert all to standard DOB format
+            if "Date of Birth" in patient_info or "Mother Date of Birth" in patient_info:
+                # Get DOB from whichever field is available
+                dob_value = patient_info.get("Date of Birth") or patient_info.get("Mother Date of Birth")
+    
+                # Set the standard DOB field and remove others
+                patient_info["DOB"] = dob_value
+    
+                # Clean up duplicate date fields
+                if "Date of Birth" in patient_info:
+                    del patient_info["Date of Birth"]
+                if "Mother Date of Birth" in patient_info:
+                    del patient_info["Mother Date of Birth"]
+            
+            if "Phone Number" in patient_info and "Mother Phone Number" in patient_info:
+                # If both exist, prefer the standard one
+                if patient_info["Phone Number"] == patient_info["Mother Phone Number"]:
+                    del patient_info["Mother Phone Number"]
+    
+    else:
+        # Process as agreement document
+        extracted_info = extract_information_signed_agreement(textract_response, pdf_text, object_key)
+    
+    # Remove infant section and consolidate with patient data if it exists
+    if "data" in extracted_info and isinstance(extracted_info["data"], dict) and "infant" in extracted_info["data"]:
+        infant_data = extracted_info["data"].pop("infant")
+        # Add infant data to patient section with clear labeling
+        for key, value in infant_data.items():
+            extracted_info["data"]["patient"][f"Infant {key}"] = value
+    
+    return extracted_info
@@ -0,0 +1,152 @@
+import glob
+import io
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+from sharedCode.json_codec import dumps_compact
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# A new file is started once the current one reaches this size or age
+MAX_BYTES = 256 * 1024 * 1024
+MAX_SECONDS = 24 * 60 * 60
+# Lines are collected in memory and written this many bytes at a time
+BUFFER_BYTES = 1024 * 1024
+# Buffered lines reach the file at least this often
+FLUSH_SECONDS = 5.0
+ZSTD_LEVEL = 3
+TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S_%f"
+
+
+def _started_at(path, name):
+    stamp = os.path.basename(path)[len(name) + 1:].split(".", 1)[0]
+    try:
+        return datetime.strptime(stamp, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None
+
+
+class RotatingNDJSONSink:
+    """Append-only newline-delimited JSON files: <directory>/<name>-<UTC start time>.ndjson[.zst]
+
+    Each add() is one compact JSON line. A run appends to the newest file when it is
+    still under max_bytes and max_seconds, so many short runs still produce a few
+    large files; otherwise a new file is started. With compress=True the files are
+    zstd streams in which every flush ends a frame, so a file cut off by a crash is
+    readable up to its last flush. Compressed files are never appended to, since a
+    new frame after a partly written one would make the rest unreadable: each run
+    starts its own. Only one process should write a given name at a time. Works on
+    its own or behind BackgroundResultWriter.
+    """
+
+    def __init__(self, directory, name, max_bytes=MAX_BYTES, max_seconds=MAX_SECONDS, compress=False,
+                 buffer_bytes=BUFFER_BYTES, flush_seconds=FLUSH_SECONDS):
+        if compress and zstandard is None:
+            raise ImportError("compress=True needs the zstandard package (pip install zstandard)")
+        self.directory = directory
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.compress = compress
+        self.buffer_bytes = buffer_bytes
+        self.flush_seconds = flush_seconds
+        self.suffix = ".ndjson.zst" if compress else ".ndjson"
+        self.path = None
+        self.raw = None
+        self.stream = None
+        self.started_at = None
+        self.pending = bytearray()
+        self.records = 0
+        self.last_flush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, record):
+        """Queue one JSON-serializable record as a line"""
+        self.pending += dumps_compact(record).encode()
+        self.pending += b"\n"
+        self.records += 1
+        if len(self.pending) >= self.buffer_bytes or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def _reusable_file(self):
+        if self.compress:
+            return None, None
+        files = sorted(glob.glob(os.path.join(self.directory, f"{glob.escape(self.name)}-*{self.suffix}")))
+        if not files:
+            return None, None
+        started_at = _started_at(files[-1], self.name)
+        if started_at is None or time.time() - started_at >= self.max_seconds \
+                or os.path.getsize(files[-1]) >= self.max_bytes:
+            return None, None
+        return files[-1], started_at
+
+    def _open(self):
+        self.path, self.started_at = self._reusable_file()
+        if self.path is None:
+            now = datetime.now(timezone.utc)
+            self.path = os.path.join(self.directory, f"{self.name}-{now.strftime(TIMESTAMP_FORMAT)}{self.suffix}")
+            self.started_at = now.timestamp()
+        self.raw = open(self.path, "ab")
+        if self.compress:
+            self.stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(self.raw)
+        else:
+            self.stream = self.raw
+
+    def _close_file(self):
+        if self.stream is not None:
+            self.stream.close()  # also closes self.raw for the zstd writer
+            if self.raw is not self.stream:
+                self.raw.close()
+        self.path = self.raw = self.stream = None
+
+    def _due_for_rotation(self):
+        return self.raw.tell() >= self.max_bytes or time.time() - self.started_at >= self.max_seconds
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        if self.stream is not None and self._due_for_rotation():
+            self._close_file()
+        if self.stream is None:
+            self._open()
+        self.stream.write(self.pending)
+        self.pending.clear()
+        if self.compress:
+            self.stream.flush(zstandard.FLUSH_FRAME)
+        else:
+            self.stream.flush()
+
+    def close(self):
+        self.flush()
+        self._close_file()
+
+
+def iter_ndjson(path):
+    """Records of one .ndjson or .ndjson.zst file, read as a stream"""
+    with open(path, "rb") as raw:
+        if path.endswith(".zst"):
+            if zstandard is None:
+                raise ImportError("Reading .zst files needs the zstandard package (pip install zstandard)")
+            raw = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        for line in io.BufferedReader(raw) if path.endswith(".zst") else raw:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_ndjson_records(directory, name):
+    """Records of every file a RotatingNDJSONSink wrote for name, oldest first"""
+    pattern = os.path.join(directory, f"{glob.escape(name)}-*.ndjson")
+    for path in sorted(glob.glob(pattern) + glob.glob(pattern + ".zst")):
+        yield from iter_ndjson(path)
@@ -0,0 +1,44 @@
+import hashlib
+
+# Bytes read from the S3 stream per write; large enough that hashing is not per-call overhead
+CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadIntegrityError(Exception):
+    """The downloaded bytes do not match what S3 says the object holds"""
+
+
+def is_single_part_etag(etag):
+    """Multipart uploads have ETags like "<md5 of part md5s>-<parts>", which are not the MD5 of the object"""
+    return '-' not in etag.strip('"')
+
+
+def download_verified(s3_client, bucket, key, target, expected_etag=None, chunk_size=CHUNK_SIZE):
+    """Stream an object into a writable file, hashing it in the same pass
+
+    Returns the hex MD5 of the bytes written. Raises DownloadIntegrityError when the
+    length differs from Content-Length, when the object's ETag is not expected_etag,
+    or when a single-part ETag does not equal the MD5. SSE-KMS ETags are not MD5s,
+    so for those only the length is checked.
+    """
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    etag = response['ETag'].strip('"')
+    if expected_etag is not None:
+        expected_etag = expected_etag.strip('"')
+        if etag != expected_etag:
+            response['Body'].close()
+            raise DownloadIntegrityError(f"{key} has changed: ETag {etag}, expected {expected_etag}")
+
+    md5 = hashlib.md5()
+    written = 0
+    for chunk in response['Body'].iter_chunks(chunk_size):
+        md5.update(chunk)
+        target.write(chunk)
+        written += len(chunk)
+    digest = md5.hexdigest()
+
+    if written != response['ContentLength']:
+        raise DownloadIntegrityError(f"{key} is truncated: got {written} of {response['ContentLength']} bytes")
+    if response.get('ServerSideEncryption') != 'aws:kms' and is_single_part_etag(etag) and digest != etag:
+        raise DownloadIntegrityError(f"{key} is corrupt: MD5 {digest} does not match ETag {etag}")
+    return digest
@@ -0,0 +1,100 @@
+from collections import defaultdict
+
+import numpy as np
+
+
+class PageArrays:
+    """Column view of one page's blocks: one NumPy array per bounding-box field
+
+    Row i of every array describes blocks[i], so a boolean mask built from the
+    arrays can be turned back into blocks with select().
+    """
+
+    def __init__(self, blocks):
+        self.blocks = list(blocks)
+        count = len(self.blocks)
+
+        boxes = np.array([self._box_row(block) for block in self.blocks], dtype=float).reshape(count, 4)
+        self.left = boxes[:, 0]
+        self.top = boxes[:, 1]
+        self.width = boxes[:, 2]
+        self.height = boxes[:, 3]
+        self.block_type = np.array([block.get('BlockType') for block in self.blocks], dtype=object)
+        self.has_text = np.fromiter(('Text' in block for block in self.blocks), dtype=bool, count=count)
+
+        self.right = self.left + self.width
+        self.bottom = self.top + self.height
+
+    @staticmethod
+    def _box_row(block):
+        bbox = block.get('Geometry', {}).get('BoundingBox', {})
+        return (bbox.get('Left', 0), bbox.get('Top', 0), bbox.get('Width', 0), bbox.get('Height', 0))
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def type_mask(self, *block_types):
+        mask = self.block_type == block_types[0]
+        for block_type in block_types[1:]:
+            mask |= self.block_type == block_type
+        return mask
+
+    def select(self, mask):
+        """Return the blocks where mask is True, in their original order"""
+        return [self.blocks[row] for row in np.flatnonzero(mask)]
+
+
+def build_page_arrays(blocks):
+    """Build one PageArrays per page; synchronous responses have no Page field and count as page 1"""
+    pages = defaultdict(list)
+    for block in blocks:
+        pages[block.get('Page', 1)].append(block)
+    return {page: PageArrays(page_blocks) for page, page_blocks in pages.items()}
+
+
+def signature_line_mask(arrays, min_width=0.2, max_height=0.05):
+    """LINE blocks with the wide, short shape a handwritten signature usually gets"""
+    return arrays.type_mask('LINE') & (arrays.width > min_width) & (arrays.height < max_height)
+
+
+def near_label_mask(arrays, label_mask, max_right=0.4, max_below=0.1, candidate_mask=None):
+    """Blocks to the right of, or just below, any of the blocks in label_mask
+
+    Pass candidate_mask to only test those rows, e.g. the output of another heuristic.
+    """
+    result = np.zeros(len(arrays), dtype=bool)
+    labels = np.flatnonzero(label_mask)
+    if candidate_mask is None:
+        candidates = np.flatnonzero(~label_mask)
+    else:
+        candidates = np.flatnonzero(candidate_mask & ~label_mask)
+    if labels.size == 0 or candidates.size == 0:
+        return result
+
+    # Broadcast every candidate (rows) against every label (columns)
+    left = arrays.left[candidates][:, None]
+    top = arrays.top[candidates][:, None]
+    right = arrays.right[candidates][:, None]
+    bottom = arrays.bottom[candidates][:, None]
+    label_left = arrays.left[labels][None, :]
+    label_top = arrays.top[labels][None, :]
+    label_right = arrays.right[labels][None, :]
+    label_bottom = arrays.bottom[labels][None, :]
+
+    same_line = (top <= label_bottom) & (bottom >= label_top)
+    right_of = same_line & (left >= label_right) & (left - label_right <= max_right)
+
+    same_column = (left <= label_right) & (right >= label_left)
+    below = same_column & (top >= label_bottom) & (top - label_bottom <= max_below)
+
+    result[candidates] = (right_of | below).any(axis=1)
+    return result
+
+
+def text_mask(arrays, predicate, block_types=('LINE',)):
+    """Evaluate predicate(text) once per block of the given types; other rows are False"""
+    mask = np.zeros(len(arrays), dtype=bool)
+    rows = np.flatnonzero(arrays.type_mask(*block_types))
+    blocks = arrays.blocks
+    mask[rows] = [bool(predicate(blocks[row].get('Text', ''))) for row in rows.tolist()]
+    return mask
@@ -0,0 +1,242 @@
+import copy
+import os
+import time
+import uuid
+from io import BytesIO
+
+from sharedCode.object_download import download_verified
+from sharedCode.pdf_text import get_pdf_text_backend
+from sharedCode.preflight import IMAGE_FORMATS, preflight_object
+
+# Images per packed PDF (one async job per query set per pack)
+PACK_SIZE = 25
+# Only images up to this size are packed; bigger ones already amortize their own request
+PACK_MAX_BYTES = 1024 * 1024
+# Packed PDFs are uploaded to a staging bucket of their own (TEXTRACT_PACK_BUCKET in .env), never the
+# document bucket, under this prefix (TEXTRACT_PACK_PREFIX), and each run deletes the packs it uploaded.
+# A pack left behind by a killed run is removed by a lifecycle rule after PACK_EXPIRY_DAYS, which
+# finalcodes/SetupPackBucket.py adds once (the pipeline never changes bucket settings).
+# Without a staging bucket every image is sent on its own.
+DEFAULT_PACK_PREFIX = "textract-packs/"
+PACK_EXPIRY_DAYS = 1
+PACK_RULE_ID = "expire-textract-packs"
+# Longest page side in the packed PDF, in points (11 inches keeps every page inside Textract's page size limit)
+PAGE_MAX_POINTS = 11 * 72
+POLL_SECONDS = 2
+
+
+def pack_prefix():
+    return os.getenv("TEXTRACT_PACK_PREFIX") or DEFAULT_PACK_PREFIX
+
+
+def is_pack_key(key):
+    """True for a packed PDF staged for Textract, which object listings must skip"""
+    return key.startswith(pack_prefix())
+
+
+def ensure_pack_expiry(s3_client, bucket, prefix, days=PACK_EXPIRY_DAYS):
+    """Add a lifecycle rule expiring objects under prefix after days, keeping the bucket's other rules
+
+    One-time setup for the staging bucket (finalcodes/SetupPackBucket.py); returns False when the rule
+    was already there.
+    """
+    try:
+        rules = s3_client.get_bucket_lifecycle_configuration(Bucket=bucket)["Rules"]
+    except s3_client.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchLifecycleConfiguration":
+            raise
+        rules = []
+    if any(rule.get("ID") == PACK_RULE_ID for rule in rules):
+        return False
+    rules.append({
+        "ID": PACK_RULE_ID,
+        "Filter": {"Prefix": prefix},
+        "Status": "Enabled",
+        "Expiration": {"Days": days},
+        "AbortIncompleteMultipartUpload": {"DaysAfterInitiation": days},
+    })
+    s3_client.put_bucket_lifecycle_configuration(Bucket=bucket, LifecycleConfiguration={"Rules": rules})
+    return True
+
+
+def pack_images_to_pdf(images):
+    """Build one PDF with a page per image: images is [(key, image bytes)]
+
+    Returns (pdf bytes, [keys in page order], [keys left out]). Images PyMuPDF cannot
+    read are left out of the PDF so the caller can send them on their own.
+    """
+    fitz = get_pdf_text_backend("pymupdf")._fitz
+    pdf = fitz.open()
+    packed_keys = []
+    unreadable_keys = []
+    for key, data in images:
+        try:
+            image = fitz.open(stream=data)
+            rect = image[0].rect
+            image.close()
+            scale = min(1, PAGE_MAX_POINTS / max(rect.width, rect.height))
+            page = pdf.new_page(width=rect.width * scale, height=rect.height * scale)
+            page.insert_image(page.rect, stream=data)
+        except Exception as e:
+            print(f"Could not pack {key}, sending it on its own: {e}")
+            unreadable_keys.append(key)
+            continue
+        packed_keys.append(key)
+    pdf_bytes = pdf.tobytes(garbage=3, deflate=True)
+    pdf.close()
+    return pdf_bytes, packed_keys, unreadable_keys
+
+
+def split_blocks_by_page(blocks, page_keys):
+    """Split a packed job's blocks back into one single-page response per source key
+
+    Every block is renumbered to Page 1, so the slices look exactly like a
+    synchronous analyze_document response for the original image.
+    """
+    page_blocks = {page_number: [] for page_number in range(1, len(page_keys) + 1)}
+    for block in blocks:
+        page_number = block.get('Page', 1)
+        if page_number in page_blocks:
+            block['Page'] = 1
+            page_blocks[page_number].append(block)
+    return {
+        key: {"Blocks": page_blocks[page_number], "DocumentMetadata": {"Pages": 1}}
+        for page_number, key in enumerate(page_keys, start=1)
+    }
+
+
+def _async_request(request):
+    """Queries only cover page 1 of an async job unless told otherwise"""
+    request = copy.deepcopy(request)
+    for query in request.get('QueriesConfig', {}).get('Queries', []):
+        query.setdefault('Pages', ['*'])
+    return request
+
+
+def _collect_job_blocks(textract_client, job_id, poll_seconds):
+    while True:
+        result = textract_client.get_document_analysis(JobId=job_id)
+        if result['JobStatus'] in ('SUCCEEDED', 'FAILED', 'PARTIAL_SUCCESS'):
+            break
+        time.sleep(poll_seconds)
+    if result['JobStatus'] == 'FAILED':
+        raise RuntimeError(f"Textract job {job_id} failed: {result.get('StatusMessage', '')}")
+
+    blocks = list(result['Blocks'])
+    next_token = result.get('NextToken')
+    while next_token:
+        result = textract_client.get_document_analysis(JobId=job_id, NextToken=next_token)
+        blocks.extend(result['Blocks'])
+        next_token = result.get('NextToken')
+    return blocks
+
+
+def analyze_packed(s3_client, textract_client, pack_bucket, images, requests, poll_seconds=POLL_SECONDS):
+    """Analyze many small images with one async job per request on a packed PDF
+
+    images is [(key, image bytes)] and requests a list of analyze arguments
+    (FeatureTypes, QueriesConfig, ...). The PDF is staged in pack_bucket.
+    Returns ({key: [response per request]}, [keys that could not be packed]).
+    """
+    pdf_bytes, page_keys, unreadable_keys = pack_images_to_pdf(images)
+    if not page_keys:
+        return {}, unreadable_keys
+
+    pack_key = f"{pack_prefix()}{uuid.uuid4().hex}.pdf"
+    s3_client.put_object(Bucket=pack_bucket, Key=pack_key, Body=pdf_bytes, ContentType='application/pdf')
+    try:
+        # Start every job before waiting on any, so they run side by side
+        job_ids = [
+            textract_client.start_document_analysis(
+                DocumentLocation={'S3Object': {'Bucket': pack_bucket, 'Name': pack_key}},
+                **_async_request(request)
+            )['JobId']
+            for request in requests
+        ]
+        slices = [split_blocks_by_page(_collect_job_blocks(textract_client, job_id, poll_seconds), page_keys)
+                  for job_id in job_ids]
+    finally:
+        s3_client.delete_object(Bucket=pack_bucket, Key=pack_key)
+
+    return {key: [request_slices[key] for request_slices in slices] for key in page_keys}, unreadable_keys
+
+
+def _analyze_single(textract_client, bucket, key, requests):
+    return [
+        textract_client.analyze_document(Document={'S3Object': {'Bucket': bucket, 'Name': key}}, **request)
+        for request in requests
+    ]
+
+
+def analyze_documents(s3_client, textract_client, bucket, keys, requests, formats=IMAGE_FORMATS, max_bytes=None,
+                      pack_size=PACK_SIZE, pack_max_bytes=PACK_MAX_BYTES, start=0, pack_bucket=None):
+    """Preflight and analyze a list of S3 images, yielding (index, key, [response per request])
+
+    Small images are collected into packs of pack_size and analyzed with one async
+    job per request; everything else (and every image when pack_size is 0) gets
+    synchronous analyze_document calls. Packed results come out once their pack
+    finishes, so the order is not strictly the order of keys. Keys before index
+    start are skipped, and a document whose preflight or Textract call fails is
+    reported and skipped. Packs are staged in pack_bucket (default
+    TEXTRACT_PACK_BUCKET); with neither set, nothing is packed.
+    """
+    pending = []
+    pack_bucket = pack_bucket or os.getenv("TEXTRACT_PACK_BUCKET")
+    if pack_size and not pack_bucket:
+        print("TEXTRACT_PACK_BUCKET is not set, analyzing every image on its own")
+        pack_size = 0
+
+    def flush():
+        indexes = {key: index for index, key in pending}
+        images = []
+        for _, key in pending:
+            data = BytesIO()
+            try:
+                download_verified(s3_client, bucket, key, data)
+            except Exception as e:
+                print(f"Could not download {key}: {e}")
+                continue
+            images.append((key, data.getvalue()))
+        pending.clear()
+        try:
+            results, unpacked = analyze_packed(s3_client, textract_client, pack_bucket, images, requests)
+        except Exception as e:
+            print(f"Packed job failed, analyzing its {len(images)} documents one at a time: {e}")
+            results, unpacked = {}, [key for key, _ in images]
+        for key, _ in images:
+            if key in results:
+                yield indexes[key], key, results[key]
+        for key in unpacked:
+            try:
+                yield indexes[key], key, _analyze_single(textract_client, bucket, key, requests)
+            except Exception as e:
+                print(f"Textract failed for {key}: {e}")
+
+    for index, key in enumerate(keys):
+        if index < start:
+            continue
+        try:
+            # One ranged GET gives the real format and size, so files Textract would reject never reach it
+            preflight = preflight_object(s3_client, bucket, key, formats, max_bytes)
+        except Exception as e:
+            print(f"Could not check {key}: {e}")
+            continue
+        if preflight["reason"]:
+            print(f"Skipping {key}: {preflight['reason']}")
+            continue
+
+        if pack_size and preflight["format"] in IMAGE_FORMATS and preflight["size"] <= pack_max_bytes:
+            pending.append((index, key))
+            if len(pending) >= pack_size:
+                yield from flush()
+            continue
+
+        try:
+            responses = _analyze_single(textract_client, bucket, key, requests)
+        except Exception as e:
+            print(f"Textract failed for {key}: {e}")
+            continue
+        yield index, key, responses
+
+    if pending:
+        yield from flush()
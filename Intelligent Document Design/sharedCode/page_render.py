@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from sharedCode.pdf_text import get_pdf_text_backend, pdf_buffer
+
+# 150 DPI grayscale keeps small print readable for Textract while the PNGs stay small
+RENDER_DPI = 150
+# Textract's limit for documents sent as Bytes to the synchronous API
+SYNC_MAX_BYTES = 10 * 1024 * 1024
+# Parallel analyze_document calls per document
+SYNC_WORKERS = 4
+
+
+def _fitz():
+    return get_pdf_text_backend("pymupdf")._fitz
+
+
+def pdf_page_count(pdf_file):
+    """Number of pages in a PDF, read from its page tree without rendering anything"""
+    with pdf_buffer(pdf_file) as buffer:
+        document = _fitz().open(stream=buffer, filetype="pdf")
+        try:
+            return document.page_count
+        finally:
+            document.close()
+
+
+def render_pdf_pages(pdf_file, pages=None, dpi=RENDER_DPI):
+    """Render PDF pages to grayscale PNGs: [(page number, png bytes)]
+
+    pages is a list of 1-based page numbers (all pages when None). A page whose PNG
+    would be over the synchronous API limit is rendered again at a lower DPI.
+    """
+    fitz = _fitz()
+    rendered = []
+    with pdf_buffer(pdf_file) as buffer:
+        document = fitz.open(stream=buffer, filetype="pdf")
+        try:
+            page_numbers = pages or range(1, document.page_count + 1)
+            for page_number in page_numbers:
+                page = document[page_number - 1]
+                page_dpi = dpi
+                while True:
+                    png = page.get_pixmap(dpi=page_dpi, colorspace=fitz.csGRAY).tobytes("png")
+                    if len(png) <= SYNC_MAX_BYTES or page_dpi <= 72:
+                        break
+                    page_dpi = int(page_dpi * 0.7)
+                rendered.append((page_number, png))
+        finally:
+            document.close()
+    return rendered
+
+
+def analyze_pages_sync(textract_client, page_images, max_workers=SYNC_WORKERS, **analyze_args):
+    """Run synchronous analyze_document on rendered pages in parallel and merge the results
+
+    Returns a response shaped like a finished get_document_analysis job: every
+    block carries the Page it came from, in page order. analyze_args are passed
+    through (FeatureTypes, QueriesConfig, ...).
+    """
+    def analyze(page_image):
+        page_number, png = page_image
+        response = textract_client.analyze_document(Document={'Bytes': png}, **analyze_args)
+        for block in response['Blocks']:
+            block['Page'] = page_number
+        return response['Blocks']
+
+    blocks = []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(page_images)) or 1) as executor:
+        for page_blocks in executor.map(analyze, page_images):
+            blocks.extend(page_blocks)
+    return {
+        "Blocks": blocks,
+        "DocumentMetadata": {"Pages": len(page_images)},
+        "JobStatus": "SUCCEEDED",
+    }
@@ -0,0 +1,110 @@
+import atexit
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Field rows buffered before a Parquet file is written (a few thousand documents)
+BATCH_ROWS = 100_000
+# Buffered rows are written at least this often, so an interrupted run loses little
+FLUSH_SECONDS = 300.0
+
+FIELD_SCHEMA_COLUMNS = ("document_key", "etag", "field", "value", "extracted_at")
+
+
+def flatten_fields(data, prefix=""):
+    """[(field path, value)] for a nested result dict: {"patient": {"Name": "x"}} -> [("patient.Name", "x")]"""
+    fields = []
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            fields.extend(flatten_fields(value, path + "."))
+        elif value is None or isinstance(value, str):
+            fields.append((path, value))
+        elif isinstance(value, (list, tuple)):
+            fields.append((path, json.dumps(value)))
+        else:
+            fields.append((path, str(value)))
+    return fields
+
+
+class ParquetResultSink:
+    """Appends extracted fields to a Parquet dataset partitioned by doc type and date
+
+    Each document becomes one row per field (document_key, etag, field, value,
+    extracted_at), so documents with different fields share one schema and readers
+    can load just the columns and fields they need. Rows are buffered and written
+    as one zstd-compressed file per partition per flush, under
+    root/doc_type=<type>/date=<YYYY-MM-DD>/ (Hive-style, which pyarrow.dataset,
+    pandas and DuckDB read as columns). A file only appears once it is complete.
+    close() writes what is left; it also runs at interpreter exit. A partition's rows
+    are only dropped once its file is written, so a failed write is retried at the
+    next flush.
+    """
+
+    def __init__(self, root, batch_rows=BATCH_ROWS, flush_seconds=FLUSH_SECONDS):
+        if pa is None:
+            raise ImportError("ParquetResultSink needs pyarrow (pip install pyarrow)")
+        self.root = root
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.run_id = uuid.uuid4().hex[:12]
+        self.schema = pa.schema([
+            ("document_key", pa.string()),
+            ("etag", pa.string()),
+            ("field", pa.string()),
+            ("value", pa.string()),
+            ("extracted_at", pa.timestamp("ms", tz="UTC")),
+        ])
+        # {(doc_type, date): {column: [values]}}
+        self.partitions = {}
+        self.buffered = 0
+        self.files_written = 0
+        self.last_flush = time.monotonic()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, document_key, etag, doc_type, data, extracted_at=None):
+        """Queue one document's result dict under doc_type"""
+        extracted_at = extracted_at or datetime.now(timezone.utc)
+        columns = self.partitions.setdefault((doc_type, extracted_at.strftime("%Y-%m-%d")),
+                                             {name: [] for name in FIELD_SCHEMA_COLUMNS})
+        etag = etag.strip('"') if etag else etag
+        for field, value in flatten_fields(data):
+            columns["document_key"].append(document_key)
+            columns["etag"].append(etag)
+            columns["field"].append(field)
+            columns["value"].append(value)
+            columns["extracted_at"].append(extracted_at)
+            self.buffered += 1
+        if self.buffered >= self.batch_rows or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        for (doc_type, date), columns in list(self.partitions.items()):
+            directory = os.path.join(self.root, f"doc_type={doc_type}", f"date={date}")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{self.run_id}-{self.files_written:05d}.parquet")
+            batch = pa.RecordBatch.from_pydict(columns, schema=self.schema)
+            # Written under a temporary name so readers never see a file without its footer
+            pq.write_table(pa.Table.from_batches([batch]), path + ".tmp", compression="zstd")
+            os.replace(path + ".tmp", path)
+            self.files_written += 1
+            del self.partitions[doc_type, date]
+            self.buffered -= len(columns["field"])
+
+    def close(self):
+        self.flush()
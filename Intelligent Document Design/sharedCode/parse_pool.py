@@ -0,0 +1,50 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from sharedCode.pdf_text import get_pdf_text_backend, join_pdf_page_text
+
+# Set in each worker by _init_worker so the backend's imports happen once per process
+_worker_backend = None
+
+
+def _init_worker(backend_name):
+    global _worker_backend
+    _worker_backend = get_pdf_text_backend(backend_name)
+
+
+def _extract_pdf_text_file(path):
+    with open(path, "rb") as pdf_file:
+        return join_pdf_page_text(_worker_backend.iter_page_text(pdf_file))
+
+
+class LocalParsePool:
+    """Process pool for CPU-bound local PDF parsing, so it runs outside the GIL
+
+    Work is handed over as file paths (see DocumentObject.path) rather than
+    pickled bytes. Workers are started and their PDF backend is imported up front,
+    so the first document does not pay for process start-up. Create the pool inside
+    the script's main() (never at import time) so spawned workers can import the
+    script safely on Windows.
+    """
+
+    def __init__(self, max_workers=None, backend=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                            initializer=_init_worker,
+                                            initargs=(backend,))
+        # Warm every worker now instead of on the first real document
+        for future in [self.executor.submit(os.getpid) for _ in range(self.max_workers)]:
+            future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def submit_pdf_text(self, path):
+        """Start extracting all text from the PDF at path; returns a Future of the text"""
+        return self.executor.submit(_extract_pdf_text_file, path)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,132 @@
+import io
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+
+# Backend used when a script does not pick one; override per run with the PDF_TEXT_BACKEND env variable
+DEFAULT_BACKEND_ORDER = ["pymupdf", "pypdf2"]
+
+
+class PyPDF2Backend:
+    """Pure-Python text extraction; a fallback that needs `pip install PyPDF2`, which requirements.txt leaves out"""
+
+    name = "pypdf2"
+
+    def __init__(self):
+        import PyPDF2
+        self._reader_class = PyPDF2.PdfReader
+
+    def iter_page_text(self, pdf_file):
+        pdf_reader = self._reader_class(pdf_file)
+        for page in pdf_reader.pages:
+            yield page.extract_text() or ""
+
+
+class PyMuPDFBackend:
+    """MuPDF (C library) text extraction; much faster than PyPDF2 but an extra dependency"""
+
+    name = "pymupdf"
+
+    def __init__(self):
+        try:
+            import pymupdf as fitz
+        except ImportError:  # PyMuPDF older than 1.24 only has the fitz name
+            import fitz
+        self._fitz = fitz
+
+    def iter_page_text(self, pdf_file):
+        with pdf_buffer(pdf_file) as buffer:
+            document = self._fitz.open(stream=buffer, filetype="pdf")
+            try:
+                for page in document:
+                    yield page.get_text("text")
+            finally:
+                document.close()
+
+
+@contextmanager
+def pdf_buffer(pdf_file):
+    """Expose the bytes of a seekable file as a buffer without copying them where possible
+
+    An in-memory file (BytesIO, or a SpooledTemporaryFile that has not spilled) gives
+    a view of its own buffer; a file on disk is memory-mapped, so the pages come from
+    the OS page cache instead of a private copy. Anything else is read once.
+    """
+    target = pdf_file
+    if isinstance(pdf_file, tempfile.SpooledTemporaryFile):
+        # Calling fileno() would force a spill to disk, so look at the underlying file
+        target = pdf_file._file
+
+    if isinstance(target, io.BytesIO):
+        view = target.getbuffer()
+        try:
+            yield view
+        finally:
+            view.release()
+        return
+
+    mapped = None
+    try:
+        target.flush()
+        mapped = mmap.mmap(target.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        # No real file descriptor (or an empty file, which mmap refuses)
+        pass
+    if mapped is None:
+        pdf_file.seek(0)
+        yield pdf_file.read()
+        return
+
+    view = memoryview(mapped)
+    try:
+        yield view
+    finally:
+        view.release()
+        mapped.close()
+
+
+PDF_TEXT_BACKENDS = {
+    PyPDF2Backend.name: PyPDF2Backend,
+    PyMuPDFBackend.name: PyMuPDFBackend,
+}
+
+_backend_cache = {}
+
+
+def get_pdf_text_backend(name=None):
+    """Return a backend by name, or the first installed one from PDF_TEXT_BACKEND / DEFAULT_BACKEND_ORDER"""
+    if name is None:
+        name = os.getenv("PDF_TEXT_BACKEND")
+    names = [name] if name else DEFAULT_BACKEND_ORDER
+
+    for candidate in names:
+        if candidate in _backend_cache:
+            return _backend_cache[candidate]
+        if candidate not in PDF_TEXT_BACKENDS:
+            raise ValueError(f"Unknown PDF text backend: {candidate}")
+        try:
+            backend = PDF_TEXT_BACKENDS[candidate]()
+        except ImportError:
+            if name:
+                raise
+            continue
+        _backend_cache[candidate] = backend
+        return backend
+    raise ImportError("No PDF text backend is installed (install PyMuPDF or PyPDF2)")
+
+
+def iter_pdf_page_text(pdf_file, backend=None):
+    """Yield the text of each page of a PDF, parsing a page only when it is asked for
+
+    Callers that only need part of the document (like the classifiers) can stop
+    early and the remaining pages are never parsed.
+    """
+    if backend is None or isinstance(backend, str):
+        backend = get_pdf_text_backend(backend)
+    yield from backend.iter_page_text(pdf_file)
+
+
+def join_pdf_page_text(page_texts):
+    """Join page texts the way the old all_text += ... loops did, without the quadratic copying"""
+    return "".join(page_text + "\n\n" for page_text in page_texts)
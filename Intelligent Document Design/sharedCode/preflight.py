@@ -0,0 +1,137 @@
+import re
+import struct
+
+from botocore.exceptions import ClientError
+
+# Enough for the PNG/JPEG/TIFF headers and a linearized PDF's first-page dictionary
+HEADER_BYTES = 16 * 1024
+
+IMAGE_FORMATS = ("jpeg", "png", "tiff")
+TEXTRACT_FORMATS = IMAGE_FORMATS + ("pdf",)
+
+# Textract rejects images with a side longer than this
+MAX_DIMENSION = 10000
+
+PDF_LINEARIZED_PAGES = re.compile(rb"/Linearized\b.*?/N\s+(\d+)", re.DOTALL)
+PDF_PAGE_TREE_COUNT = re.compile(rb"/Type\s*/Pages\b[^>]*?/Count\s+(\d+)", re.DOTALL)
+
+
+def _jpeg_size(data):
+    position = 2
+    while position + 9 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:  # fill byte
+            position += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            position += 2
+            continue
+        length = struct.unpack(">H", data[position + 2:position + 4])[0]
+        # SOF0-SOF15, excluding DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[position + 5:position + 9])
+            return width, height
+        position += 2 + length
+    return None
+
+
+def _tiff_size(data):
+    endian = "<" if data[:2] == b"II" else ">"
+    try:
+        offset = struct.unpack(endian + "I", data[4:8])[0]
+        count = struct.unpack(endian + "H", data[offset:offset + 2])[0]
+    except struct.error:
+        return None
+    size = {}
+    for entry in range(count):
+        start = offset + 2 + entry * 12
+        if start + 12 > len(data):
+            break
+        tag, field_type = struct.unpack(endian + "HH", data[start:start + 4])
+        if tag in (256, 257):  # ImageWidth, ImageLength
+            code = "H" if field_type == 3 else "I"
+            size[tag] = struct.unpack(endian + code, data[start + 8:start + 8 + struct.calcsize(code)])[0]
+    if 256 in size and 257 in size:
+        return size[256], size[257]
+    return None
+
+
+def _pdf_page_count(data):
+    match = PDF_LINEARIZED_PAGES.search(data) or PDF_PAGE_TREE_COUNT.search(data)
+    return int(match.group(1)) if match else None
+
+
+def sniff_header(data):
+    """Identify a document from its first bytes: {"format", "width", "height", "page_count"}
+
+    Values that are not in the header (like the page count of a PDF whose page tree
+    is at the end of the file) are None.
+    """
+    info = {"format": "unknown", "width": None, "height": None, "page_count": None}
+    size = None
+    if data.startswith(b"%PDF-") or b"%PDF-" in data[:1024]:
+        info["format"] = "pdf"
+        info["page_count"] = _pdf_page_count(data)
+    elif data.startswith(b"\x89PNG\r\n\x1a\n"):
+        info["format"] = "png"
+        if len(data) >= 24:
+            size = struct.unpack(">II", data[16:24])
+        info["page_count"] = 1
+    elif data.startswith(b"\xff\xd8"):
+        info["format"] = "jpeg"
+        size = _jpeg_size(data)
+        info["page_count"] = 1
+    elif data[:4] in (b"II*\x00", b"MM\x00*"):
+        info["format"] = "tiff"
+        size = _tiff_size(data)
+    elif data[:6] in (b"GIF87a", b"GIF89a"):
+        info["format"] = "gif"
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        info["format"] = "webp"
+    elif data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        info["format"] = "heic"
+    elif data.lstrip()[:1] in (b"{", b"["):
+        info["format"] = "json"
+    if size:
+        info["width"], info["height"] = size
+    return info
+
+
+def preflight_object(s3_client, bucket, key, formats=TEXTRACT_FORMATS, max_bytes=None, max_pages=None,
+                     header_bytes=HEADER_BYTES):
+    """Check an S3 object with one ranged GET before spending a Textract call on it
+
+    Returns the sniffed header info plus "size", "etag" and "reason"; reason is None
+    when the object can be sent on, otherwise a short explanation of why not. This
+    replaces the head_object size check, since the Content-Range carries the size.
+    """
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{header_bytes - 1}")
+    except ClientError as e:
+        # S3 answers a range request on an empty object with InvalidRange
+        if e.response.get('Error', {}).get('Code') != 'InvalidRange':
+            raise
+        response = s3_client.head_object(Bucket=bucket, Key=key)
+        response['Body'] = None
+    data = response['Body'].read() if response['Body'] is not None else b""
+    content_range = response.get('ContentRange')
+    size = int(content_range.rsplit('/', 1)[1]) if content_range else response['ContentLength']
+
+    info = sniff_header(data)
+    info["size"] = size
+    info["etag"] = response.get('ETag')
+    info["reason"] = None
+
+    if size == 0:
+        info["reason"] = "empty file"
+    elif info["format"] not in formats:
+        info["reason"] = f"{info['format']} content is not one of {', '.join(formats)}"
+    elif max_bytes is not None and size > max_bytes:
+        info["reason"] = f"{size} bytes is over the {max_bytes} byte limit"
+    elif info["width"] is not None and max(info["width"], info["height"]) > MAX_DIMENSION:
+        info["reason"] = f"{info['width']}x{info['height']} image is larger than {MAX_DIMENSION} px"
+    elif max_pages is not None and info["page_count"] is not None and info["page_count"] > max_pages:
+        info["reason"] = f"{info['page_count']} pages is over the {max_pages} page limit"
+    return info
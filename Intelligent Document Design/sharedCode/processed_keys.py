@@ -0,0 +1,86 @@
+import hashlib
+import math
+
+from psycopg2 import sql
+
+# Tables with more rows than this are loaded into a Bloom filter instead of a set
+MAX_SET_ROWS = 500_000
+# Bloom filter false positive rate; positives are checked against the table, so this only sets how many get checked
+BLOOM_ERROR_RATE = 0.001
+# Rows fetched per round trip while loading, and pairs per query when checking Bloom positives
+FETCH_SIZE = 10_000
+
+
+class BloomFilter:
+    """Fixed-size set membership test that can say "maybe" but never misses an added item"""
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class ProcessedKeys:
+    """The (document_key, etag) pairs already stored in a result table, loaded once at startup
+
+    Small tables are held as a set. Past max_set_rows a Bloom filter is used instead,
+    and the documents it reports as present are confirmed against the table in
+    batches, so a false positive never skips a document that still needs work.
+    Rows stored before the etag column existed have an empty ETag and count as
+    already processed whatever the document's current ETag is.
+    """
+
+    def __init__(self, connection, table, max_set_rows=MAX_SET_ROWS, error_rate=BLOOM_ERROR_RATE):
+        self.connection = connection
+        self.table = table
+        with connection.cursor() as cursor:
+            cursor.execute(sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(table)))
+            self.rows = cursor.fetchone()[0]
+        self.keys = set() if self.rows <= max_set_rows else BloomFilter(self.rows, error_rate)
+        self.exact = isinstance(self.keys, set)
+
+        # A named cursor streams the rows instead of loading the whole result into memory first
+        with connection.cursor(name=f"processed_{table}") as cursor:
+            cursor.itersize = FETCH_SIZE
+            cursor.execute(sql.SQL("SELECT document_key, etag FROM {}").format(sql.Identifier(table)))
+            for document_key, etag in cursor:
+                self.keys.add(self._item(document_key, etag))
+        connection.commit()
+
+    @staticmethod
+    def _item(document_key, etag):
+        return f"{document_key}\0{etag}"
+
+    def _confirm(self, pairs):
+        stored = set()
+        query = sql.SQL(
+            "SELECT DISTINCT p.document_key, p.etag FROM {} AS t "
+            "JOIN unnest(%s::text[], %s::text[]) AS p(document_key, etag) "
+            "ON t.document_key = p.document_key AND t.etag IN (p.etag, '')").format(sql.Identifier(self.table))
+        with self.connection.cursor() as cursor:
+            for start in range(0, len(pairs), FETCH_SIZE):
+                batch = pairs[start:start + FETCH_SIZE]
+                cursor.execute(query, ([key for key, _ in batch], [etag for _, etag in batch]))
+                stored.update(cursor.fetchall())
+        self.connection.commit()
+        return stored
+
+    def unprocessed(self, keys, etags):
+        """The keys (in order) whose current ETag is not stored yet; etags maps key -> ETag"""
+        maybe = [(key, etags[key]) for key in keys
+                 if self._item(key, etags[key]) in self.keys or self._item(key, "") in self.keys]
+        stored = set(maybe) if self.exact else self._confirm(maybe)
+        return [key for key in keys if (key, etags[key]) not in stored]
@@ -0,0 +1,36 @@
+from sharedCode.textract_queries import query_answers, query_confidences
+
+
+def signature_value(response):
+    """The stored signature answer: "Present" when Textract found a SIGNATURE block, otherwise "" (unanswered)"""
+    for block in response.get("Blocks", []):
+        if block.get("BlockType") == "SIGNATURE":
+            return "Present"
+    return ""
+
+
+def parse_query_responses(responses, signature_alias=None):
+    """(result, confidence_score, fields) for one document from its query responses, one per request
+
+    result is the stored JSON ({"confidence": ..., "document_data": {alias: answer}}),
+    confidence_score the share of answered queries, and fields the
+    [(alias, value, answer confidence)] rows for the field table. With signature_alias,
+    signature_value of the first response is stored under that key as well.
+    """
+    document_data = {}
+    confidences = {}
+    if signature_alias:
+        document_data[signature_alias] = signature_value(responses[0])
+
+    for response in responses:
+        for _, alias, answer in query_answers(response):
+            document_data[alias] = answer
+        confidences.update(query_confidences(response))
+
+    key_count = sum(1 for key in document_data if key)
+    empty_count = sum(1 for value in document_data.values() if value == "")
+    confidence_score = (key_count - empty_count) / key_count
+    result = {"confidence": {"confidence_score": confidence_score}, "document_data": document_data}
+
+    fields = [(alias, value, confidences.get(alias)) for alias, value in document_data.items()]
+    return result, confidence_score, fields
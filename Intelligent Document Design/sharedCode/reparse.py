@@ -0,0 +1,147 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from sharedCode.agreement_fields import parse_agreement_blocks
+from sharedCode.json_codec import dumps_compact
+from sharedCode.local_cache import LocalObjectCache
+from sharedCode.medical_extraction import extract_document_info, extract_information_signed_agreement
+from sharedCode.pdf_text import iter_pdf_page_text, join_pdf_page_text
+from sharedCode.query_results import parse_query_responses
+from sharedCode.response_archive import request_fingerprint
+from sharedCode.textract_queries import (DOCUMENT_ANALYSIS_REQUESTS, SIGNED_AGREEMENT_REQUESTS, TABLE_REQUESTS,
+                                         query_aliases)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Archive doc types are the result table names for the finalcodes scripts...
+AGREEMENT_DOC_TYPE = "signedagreement"
+# Query keys the scripts store besides the query answers
+SIGNATURE_ALIASES = {"breastpump": "PHYSICIAN_SIGNATURE"}
+AGREEMENT_ALIASES = ["name", "date", "signature"]
+# ...and Ethan_PDFandJPG3's labels, whose results go to its Parquet dataset instead
+DATASET_DOC_TYPES = ("PRESCRIPTION", "SIGNED_AGREEMENT")
+# Tables whose scripts only print their results (writeResults = False); re-parsing would fill
+# tables no live run keeps up to date
+PRINT_ONLY_DOC_TYPES = ("insurance1", "insurance2", "prescription2")
+REPARSE_DOC_TYPES = ([doc_type for doc_type in TABLE_REQUESTS if doc_type not in PRINT_ONLY_DOC_TYPES]
+                     + [AGREEMENT_DOC_TYPE] + list(DATASET_DOC_TYPES))
+# Documents handed to a worker at a time; large enough that pickling overhead stays small
+CHUNK_SIZE = 16
+
+# Set in each worker by _init_worker
+_pdf_backend = None
+_object_cache = None
+
+
+def doc_type_requests(doc_type):
+    """The analyze arguments the archived responses of doc_type must have been made with"""
+    if doc_type in TABLE_REQUESTS:
+        return TABLE_REQUESTS[doc_type]
+    if doc_type == AGREEMENT_DOC_TYPE:
+        return SIGNED_AGREEMENT_REQUESTS
+    if doc_type in DATASET_DOC_TYPES:
+        return DOCUMENT_ANALYSIS_REQUESTS
+    raise ValueError(f"Unknown doc type: {doc_type}")
+
+
+def result_aliases(doc_type):
+    """Field names stored for doc_type, for the result sink's prepare()"""
+    if doc_type == AGREEMENT_DOC_TYPE:
+        return AGREEMENT_ALIASES
+    signature_alias = SIGNATURE_ALIASES.get(doc_type)
+    return query_aliases(TABLE_REQUESTS[doc_type]) + ([signature_alias] if signature_alias else [])
+
+
+def find_reparse_jobs(archive, doc_types):
+    """([(doc_type, document_key, etag, [response path per request])], [(doc_type, document_key)] missing responses)
+
+    Only each document's latest archived version counts, and only responses to the
+    current requests of its doc type, so a changed query set is never parsed with
+    the wrong mapping.
+    """
+    fingerprints = {doc_type: [request_fingerprint(request) for request in doc_type_requests(doc_type)]
+                    for doc_type in doc_types}
+    latest = {}
+    for record in archive.iter_index():
+        doc_type = record["doc_type"]
+        if doc_type in fingerprints and record["fingerprint"] in fingerprints[doc_type]:
+            latest[(doc_type, record["document_key"])] = record["etag"]
+
+    jobs = []
+    missing = []
+    for (doc_type, document_key), etag in latest.items():
+        paths = [archive.path(etag, fingerprint) for fingerprint in fingerprints[doc_type]]
+        if all(os.path.exists(path) for path in paths):
+            jobs.append((doc_type, document_key, etag, paths))
+        else:
+            missing.append((doc_type, document_key))
+    return jobs, missing
+
+
+def _init_worker(pdf_backend):
+    global _pdf_backend, _object_cache
+    _pdf_backend = pdf_backend
+    _object_cache = LocalObjectCache(None)
+
+
+def _load_response(path):
+    with open(path, "rb") as archived:
+        return json.loads(zstandard.ZstdDecompressor().decompress(archived.read()))
+
+
+def _cached_pdf_text(document_key, etag):
+    # The live run also reads the PDF's own text; without S3 that is only possible from the local cache
+    if not document_key.lower().endswith(".pdf"):
+        return None
+    path = _object_cache.cached_path(document_key, etag)
+    if path is None:
+        return None
+    with open(path, "rb") as pdf_file:
+        return join_pdf_page_text(iter_pdf_page_text(pdf_file, _pdf_backend))
+
+
+def reparse_document(job):
+    """Run the current extractor of a job's doc type on its archived responses
+
+    Returns (doc_type, document_key, etag, output, error). output is
+    (result JSON, confidence_score, fields) for result tables and the extracted
+    dict for the Parquet dataset; on failure it is None and error says why.
+    """
+    doc_type, document_key, etag, paths = job
+    try:
+        responses = [_load_response(path) for path in paths]
+        if doc_type in TABLE_REQUESTS:
+            result, confidence_score, fields = parse_query_responses(responses, SIGNATURE_ALIASES.get(doc_type))
+            output = (dumps_compact(result), confidence_score, fields)
+        elif doc_type == AGREEMENT_DOC_TYPE:
+            result, confidence_score, fields = parse_agreement_blocks(responses[0]["Blocks"])
+            output = (dumps_compact(result), confidence_score, fields)
+        elif doc_type == "PRESCRIPTION":
+            output = extract_document_info(responses[0], _cached_pdf_text(document_key, etag), document_key)
+        else:
+            output = extract_information_signed_agreement(responses[0], _cached_pdf_text(document_key, etag),
+                                                          document_key)
+        return doc_type, document_key, etag, output, None
+    except Exception as e:
+        return doc_type, document_key, etag, None, str(e)
+
+
+def reparse_documents(jobs, max_workers=None, pdf_backend=None, chunksize=CHUNK_SIZE):
+    """reparse_document's result for every job, in order, computed across worker processes
+
+    max_workers=None uses one per CPU core and 0 runs everything in this process.
+    Workers read the archive files themselves, so only paths and results are pickled.
+    """
+    if zstandard is None:
+        raise ImportError("Reading archived responses needs the zstandard package (pip install zstandard)")
+    if max_workers == 0:
+        _init_worker(pdf_backend)
+        yield from map(reparse_document, jobs)
+        return
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count() or 1,
+                             initializer=_init_worker, initargs=(pdf_backend,)) as executor:
+        yield from executor.map(reparse_document, jobs, chunksize=chunksize)
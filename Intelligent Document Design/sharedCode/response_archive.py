@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from sharedCode.json_codec import dumps_compact
+from sharedCode.ndjson_sink import RotatingNDJSONSink, iter_ndjson_records
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_ARCHIVE_DIR = os.path.join(os.path.expanduser('~'), '.local', 'share', 'valere-ocr', 'textract-responses')
+# Responses are written once and read rarely, so a higher level than the NDJSON streams is worth it
+ZSTD_LEVEL = 10
+INDEX_NAME = "index"
+
+
+def request_fingerprint(request):
+    """Short stable hash of the analyze arguments (FeatureTypes, QueriesConfig, ...) a response came from"""
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+def prune_response(response, drop_polygons=True, drop_block_types=()):
+    """Copy of a Textract response without what the extractors never read
+
+    ResponseMetadata (HTTP details) always goes. Polygon points are emptied in
+    every Geometry (BoundingBox stays; the key is kept because trp2 requires it),
+    and blocks of drop_block_types are removed along with the relationship ids
+    that pointed at them.
+    """
+    dropped = {block["Id"] for block in response.get("Blocks", []) if block.get("BlockType") in drop_block_types}
+    blocks = []
+    for block in response.get("Blocks", []):
+        if block["Id"] in dropped:
+            continue
+        block = dict(block)
+        if drop_polygons and "Geometry" in block:
+            block["Geometry"] = dict(block["Geometry"], Polygon=[])
+        if dropped and "Relationships" in block:
+            relationships = [dict(relationship, Ids=[i for i in relationship["Ids"] if i not in dropped])
+                             for relationship in block["Relationships"]]
+            relationships = [relationship for relationship in relationships if relationship["Ids"]]
+            if relationships:
+                block["Relationships"] = relationships
+            else:
+                del block["Relationships"]
+        blocks.append(block)
+    pruned = {key: value for key, value in response.items() if key not in ("Blocks", "ResponseMetadata")}
+    pruned["Blocks"] = blocks
+    return pruned
+
+
+class ResponseArchive:
+    """zstd-compressed Textract responses on local disk, addressed by ETag and request fingerprint
+
+    The same object version analyzed with the same arguments gives the same
+    response, so each (ETag, fingerprint) is stored once, under
+    responses/<first two ETag characters>/<ETag>-<fingerprint>.json.zst. Every
+    put() also appends (document_key, etag, fingerprint, doc_type) to the index
+    NDJSON stream, since several keys can hold the same bytes; the line is
+    written to the file right away, so after a crash every archived response is
+    still indexed. Location comes
+    from RESPONSE_ARCHIVE_DIR in .env when not given.
+    """
+
+    def __init__(self, archive_dir=None, drop_polygons=True, drop_block_types=(), level=ZSTD_LEVEL):
+        if zstandard is None:
+            raise ImportError("ResponseArchive needs the zstandard package (pip install zstandard)")
+        self.archive_dir = archive_dir or os.getenv("RESPONSE_ARCHIVE_DIR") or DEFAULT_ARCHIVE_DIR
+        self.drop_polygons = drop_polygons
+        self.drop_block_types = tuple(drop_block_types)
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.index = RotatingNDJSONSink(self.archive_dir, INDEX_NAME)
+        self.stored = 0
+        self.raw_bytes = 0
+        self.pruned_bytes = 0
+        self.stored_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def path(self, etag, fingerprint):
+        etag = etag.strip('"')
+        return os.path.join(self.archive_dir, "responses", etag[:2], f"{etag}-{fingerprint}.json.zst")
+
+    def put(self, document_key, etag, fingerprint, response, doc_type=None):
+        """Archive one response (skipped when this ETag and fingerprint are already stored); returns its path"""
+        etag = etag.strip('"')
+        path = self.path(etag, fingerprint)
+        if not os.path.exists(path):
+            raw = dumps_compact(response).encode()
+            pruned = dumps_compact(prune_response(response, self.drop_polygons, self.drop_block_types)).encode()
+            compressed = self.compressor.compress(pruned)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written under a temporary name so a crash never leaves a truncated entry behind
+            handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+            with os.fdopen(handle, "wb") as temp_file:
+                temp_file.write(compressed)
+            os.replace(temp_path, path)
+            self.stored += 1
+            self.raw_bytes += len(raw)
+            self.pruned_bytes += len(pruned)
+            self.stored_bytes += len(compressed)
+        self.label(document_key, etag, fingerprint, doc_type)
+        return path
+
+    def label(self, document_key, etag, fingerprint, doc_type):
+        """Index an archived response under document_key and doc_type without storing it again
+
+        For scripts that only know a document's type after analyzing it.
+        """
+        self.index.add({
+            "document_key": document_key,
+            "etag": etag.strip('"'),
+            "fingerprint": fingerprint,
+            "doc_type": doc_type,
+            "archived_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        })
+        # One small write per response, next to the response file itself
+        self.index.flush()
+
+    def get(self, etag, fingerprint):
+        """The archived (pruned) response, or None when there is none"""
+        path = self.path(etag, fingerprint)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as archived:
+            return json.loads(zstandard.ZstdDecompressor().decompress(archived.read()))
+
+    def iter_index(self):
+        """Every index record written so far, oldest first"""
+        self.index.flush()
+        return iter_ndjson_records(self.archive_dir, INDEX_NAME)
+
+    def report(self):
+        """One line on what this run stored and how much smaller it got"""
+        if not self.stored:
+            return "No new responses archived"
+        megabytes = 1024 * 1024
+        return (f"Archived {self.stored} responses: {self.raw_bytes / megabytes:.1f} MB of JSON, "
+                f"{self.pruned_bytes / megabytes:.1f} MB pruned, {self.stored_bytes / megabytes:.1f} MB stored "
+                f"({self.raw_bytes / self.stored_bytes:.1f}x smaller)")
+
+    def close(self):
+        self.index.close()
@@ -0,0 +1,154 @@
+import json
+
+from psycopg2 import sql
+
+# Result rows are written with dumps_compact into a jsonb column: Postgres keeps them in
+# its binary form (no whitespace) and can index into them
+JSON_COLUMN = "json"
+# One row per extracted field of every document, for lookups like "the facesheet with MRN X"
+FIELD_TABLE = "document_fields"
+
+
+def column_type(connection, table, column):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT data_type FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+            (table, column))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def convert_to_jsonb(connection, table, column=JSON_COLUMN):
+    """Change a text/json result column to jsonb in place; returns False when it already was"""
+    if column_type(connection, table, column) == "jsonb":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(sql.SQL("ALTER TABLE {table} ALTER COLUMN {column} TYPE jsonb USING {column}::jsonb").format(
+            table=sql.Identifier(table), column=sql.Identifier(column)))
+    return True
+
+
+def rename_document_keys(connection, table, key_map, column=JSON_COLUMN):
+    """Rename keys of every row's "document_data" object (old key -> new key); returns the rows changed
+
+    Keys that are not in key_map are kept as they are. The column must already be jsonb.
+    """
+    query = sql.SQL("""
+        UPDATE {table} SET {column} = jsonb_set({column}, '{{document_data}}', (
+            SELECT COALESCE(jsonb_object_agg(COALESCE(renamed.value, field.key), field.value), '{{}}'::jsonb)
+            FROM jsonb_each({column} -> 'document_data') AS field
+            LEFT JOIN jsonb_each_text(%(key_map)s::jsonb) AS renamed ON renamed.key = field.key
+        ))
+        WHERE jsonb_typeof({column} -> 'document_data') = 'object'
+          AND EXISTS (
+            SELECT 1 FROM jsonb_object_keys({column} -> 'document_data') AS old_key
+            WHERE %(key_map)s::jsonb ? old_key
+          )
+    """).format(table=sql.Identifier(table), column=sql.Identifier(column))
+    with connection.cursor() as cursor:
+        cursor.execute(query, {"key_map": json.dumps(key_map)})
+        return cursor.rowcount
+
+
+def create_json_index(connection, table, column=JSON_COLUMN):
+    """GIN index for containment lookups such as json @> '{"document_data": {"MEMBER_ID": "..."}}'"""
+    with connection.cursor() as cursor:
+        cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {index} ON {table} USING gin ({column} jsonb_path_ops)").format(
+            index=sql.Identifier(f"{table}_{column}_idx"), table=sql.Identifier(table), column=sql.Identifier(column)))
+
+
+def ensure_result_key(connection, table):
+    """Add the etag column and a unique (document_key, etag) constraint the sink's upserts rely on
+
+    A missing table is created. Rows from before the etag column get an empty ETag,
+    which ProcessedKeys counts as any version of that document. A row_id serial
+    records insertion order; existing rows are numbered in their current physical
+    order, so run this before any UPDATE moves them. If a document was stored more
+    than once, only its highest row_id is kept so the constraint can be created.
+    Commits.
+    """
+    constraint = f"{table}_document_key_etag_key"
+    table_id = sql.Identifier(table)
+    with connection.cursor() as cursor:
+        cursor.execute(sql.SQL("""
+            CREATE TABLE IF NOT EXISTS {table} (
+                row_id bigserial,
+                document_key text NOT NULL,
+                etag text NOT NULL DEFAULT '',
+                json jsonb,
+                confidence_score double precision,
+                CONSTRAINT {constraint} UNIQUE (document_key, etag)
+            )
+        """).format(table=table_id, constraint=sql.Identifier(constraint)))
+        cursor.execute(sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS row_id bigserial").format(table_id))
+        cursor.execute("SELECT 1 FROM pg_constraint WHERE conname = %s", (constraint,))
+        if cursor.fetchone():
+            connection.commit()
+            return False
+        cursor.execute(sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS etag text NOT NULL DEFAULT ''").format(table_id))
+        cursor.execute(sql.SQL("""
+            DELETE FROM {table} AS older USING {table} AS newer
+            WHERE older.document_key = newer.document_key AND older.etag = newer.etag AND older.row_id < newer.row_id
+        """).format(table=table_id))
+        if cursor.rowcount:
+            print(f"{table}: removed {cursor.rowcount} duplicate rows")
+        cursor.execute(sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} UNIQUE (document_key, etag)").format(
+            table_id, sql.Identifier(constraint)))
+    connection.commit()
+    return True
+
+
+def wide_view_name(doc_type):
+    return f"{doc_type}_fields"
+
+
+def ensure_field_table(connection, doc_type, aliases, table=FIELD_TABLE):
+    """Create the field table and a materialized view with one column per alias for doc_type
+
+    The view is rebuilt when the aliases no longer match its columns. Lookups on a
+    field should use the field table's (alias, value) index; the view is for reading
+    whole documents of one type as rows. Commits.
+    """
+    view = wide_view_name(doc_type)
+    with connection.cursor() as cursor:
+        cursor.execute(sql.SQL("""
+            CREATE TABLE IF NOT EXISTS {table} (
+                document_key text NOT NULL,
+                etag text NOT NULL DEFAULT '',
+                doc_type text NOT NULL,
+                alias text NOT NULL,
+                value text,
+                confidence real,
+                PRIMARY KEY (doc_type, document_key, alias)
+            )
+        """).format(table=sql.Identifier(table)))
+        cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (alias, value)").format(
+            sql.Identifier(f"{table}_alias_value_idx"), sql.Identifier(table)))
+
+        cursor.execute("""
+            SELECT attname FROM pg_attribute
+            WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped ORDER BY attnum
+        """, (view,))
+        columns = ["document_key", "etag"] + list(aliases)
+        if [row[0] for row in cursor.fetchall()] != columns:
+            pivot = [sql.SQL("max(value) FILTER (WHERE alias = {}) AS {}").format(sql.Literal(alias), sql.Identifier(alias))
+                     for alias in aliases]
+            cursor.execute(sql.SQL("DROP MATERIALIZED VIEW IF EXISTS {}").format(sql.Identifier(view)))
+            cursor.execute(sql.SQL("""
+                CREATE MATERIALIZED VIEW {view} AS
+                SELECT document_key, etag, {pivot} FROM {table}
+                WHERE doc_type = {doc_type}
+                GROUP BY document_key, etag
+            """).format(view=sql.Identifier(view), pivot=sql.SQL(", ").join(pivot), table=sql.Identifier(table),
+                        doc_type=sql.Literal(doc_type)))
+            # A unique index lets the view be refreshed without blocking readers
+            cursor.execute(sql.SQL("CREATE UNIQUE INDEX {} ON {} (document_key, etag)").format(
+                sql.Identifier(f"{view}_key_idx"), sql.Identifier(view)))
+    connection.commit()
+
+
+def refresh_wide_view(connection, doc_type):
+    """Bring a doc type's materialized view up to date with the field table. Commits."""
+    with connection.cursor() as cursor:
+        cursor.execute(sql.SQL("REFRESH MATERIALIZED VIEW CONCURRENTLY {}").format(sql.Identifier(wide_view_name(doc_type))))
+    connection.commit()
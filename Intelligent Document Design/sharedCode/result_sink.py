@@ -0,0 +1,342 @@
+import sqlite3
+import time
+from contextlib import closing
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from sharedCode.processed_keys import ProcessedKeys
+from sharedCode.result_schema import ensure_field_table, ensure_result_key, refresh_wide_view
+
+# Columns every finalcodes result table has
+RESULT_COLUMNS = ("document_key", "etag", "json", "confidence_score")
+# Unique key of a result table: a rerun on the same object version replaces its row instead of adding one
+RESULT_KEY = ("document_key", "etag")
+# Rows per multi-row INSERT / commit
+BATCH_SIZE = 100
+# Buffered rows are written at least this often, so a slow run still saves progress
+FLUSH_SECONDS = 5.0
+
+
+class BatchedResultSink:
+    """Buffers result rows and writes them in batches, one transaction per batch
+
+    A batch is written when batch_size rows are waiting or flush_seconds have passed
+    since the last write (checked as rows are added). Call close() (or use a
+    with-block) at the end of the run so the last partial batch is written. If a
+    batch fails, its rows are retried one at a time so a single bad row only loses
+    itself. Rows are upserted on conflict_columns; pass None for plain inserts.
+
+    Rows stay queued until their transaction commits. A batch whose connection
+    drops (connection_errors) is written again once on a fresh connection; if that
+    fails too the rows are kept and retried at the next flush, and close() raises
+    when they still cannot be written.
+
+    With field_table set, the (alias, value, confidence) fields passed to add() are
+    also written there, one row per field with the table name as doc_type, in the
+    same transaction. A document's earlier fields are replaced.
+
+    Subclasses connect to a database: they write a batch (_write_rows), create the
+    tables (prepare), list stored documents (unprocessed) and update the per-field
+    view (refresh_views).
+    """
+
+    # Errors meaning the connection is gone rather than the rows being bad
+    connection_errors = ()
+
+    def __init__(self, table, columns=RESULT_COLUMNS, batch_size=BATCH_SIZE, flush_seconds=FLUSH_SECONDS,
+                 conflict_columns=RESULT_KEY, field_table=None):
+        self.connection = None
+        self.table = table
+        self.field_table = field_table
+        self.columns = tuple(columns)
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.rows = []
+        self.last_flush = time.monotonic()
+        self.written = 0
+        # The error of the last flush, while its rows are still waiting
+        self.error = None
+        self.conflict_columns = tuple(conflict_columns or ())
+        self._key_indexes = [self.columns.index(column) for column in self.conflict_columns]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, *row, fields=None):
+        """Queue one row, in the order of columns, and optionally its [(alias, value, confidence)] fields"""
+        self.rows.append((row, fields))
+        # After a failed flush only the timer retries, rather than every add()
+        full = len(self.rows) >= self.batch_size and self.error is None
+        if full or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def _field_rows(self, entries):
+        # Keyed by document and alias, since one statement cannot upsert the same field twice
+        field_rows = {}
+        for row, fields in entries:
+            document_key, etag = row[0], row[1]
+            for alias, value, confidence in fields or ():
+                field_rows[document_key, alias] = (document_key, etag, self.table, alias, value, confidence)
+        return list(field_rows.values())
+
+    def _connect(self):
+        """Make self.connection usable for one batch"""
+
+    def _disconnect(self):
+        """Called after each batch"""
+
+    def _reconnect(self):
+        """Replace a dropped connection; returns False when that is not possible"""
+        return False
+
+    def _rollback(self):
+        try:
+            self.connection.rollback()
+        except self.connection_errors:
+            # Nothing to roll back on a dropped connection; the next write reconnects
+            pass
+
+    def _write_rows(self, entries):
+        raise NotImplementedError
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.rows:
+            return
+        entries = self.rows
+        if self.conflict_columns:
+            # One INSERT ... ON CONFLICT cannot touch the same row twice, so keep the last row per key
+            entries = list({tuple(entry[0][i] for i in self._key_indexes): entry for entry in entries}.values())
+        try:
+            self._connect()
+            try:
+                self._flush_rows(entries)
+            finally:
+                self._disconnect()
+        except Exception as e:
+            self.error = e
+            raise
+        self.rows = []
+        self.error = None
+
+    def _write_batch(self, entries):
+        try:
+            self._write_rows(entries)
+        except self.connection_errors as e:
+            if not self._reconnect():
+                raise
+            print(f"Lost the connection while writing to {self.table}, retrying on a new one: {e}")
+            self._write_rows(entries)
+        self.written += len(entries)
+
+    def _flush_rows(self, entries):
+        try:
+            self._write_batch(entries)
+            return
+        except self.connection_errors:
+            raise
+        except Exception as e:
+            self._rollback()
+            print(f"Batch insert into {self.table} failed, retrying {len(entries)} rows one at a time: {e}")
+
+        for entry in entries:
+            try:
+                self._write_batch([entry])
+            except self.connection_errors:
+                raise
+            except Exception as e:
+                self._rollback()
+                print(f"Could not insert {entry[0][0]} into {self.table}: {e}")
+
+    def prepare(self, aliases=()):
+        """Create the result table (and the field table and view for aliases) if they are missing"""
+        raise NotImplementedError
+
+    def unprocessed(self, keys, etags):
+        """The keys (in order) whose current ETag is not stored yet; etags maps key -> ETag"""
+        raise NotImplementedError
+
+    def refresh_views(self):
+        """Bring the per-field view up to date"""
+
+    def close(self):
+        """Write the last batch and update the per-field view; raises if queued rows could not be written"""
+        try:
+            self.flush()
+        except Exception as e:
+            raise RuntimeError(f"{len(self.rows)} rows could not be written to {self.table}: {e}") from e
+        if self.field_table:
+            self.refresh_views()
+
+
+class PostgresResultSink(BatchedResultSink):
+    """Result sink writing with one multi-row INSERT and one commit per batch
+
+    Pass pool= (a psycopg2 pool) instead of a connection to borrow a connection for
+    each batch. Upserts need a unique constraint on conflict_columns, which
+    prepare() adds (see result_schema.ensure_result_key). Only a pooled sink can
+    replace a dropped connection.
+    """
+
+    connection_errors = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+    def __init__(self, connection, table, columns=RESULT_COLUMNS, batch_size=BATCH_SIZE, flush_seconds=FLUSH_SECONDS,
+                 pool=None, conflict_columns=RESULT_KEY, field_table=None):
+        super().__init__(table, columns, batch_size, flush_seconds, conflict_columns, field_table)
+        self.connection = connection
+        self.pool = pool
+        self._insert = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+            sql.Identifier(table), sql.SQL(", ").join(map(sql.Identifier, self.columns)))
+        if self.conflict_columns:
+            updates = [sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(column))
+                       for column in self.columns if column not in self.conflict_columns]
+            self._insert += sql.SQL(" ON CONFLICT ({}) DO UPDATE SET {}").format(
+                sql.SQL(", ").join(map(sql.Identifier, self.conflict_columns)), sql.SQL(", ").join(updates))
+        if field_table:
+            self._delete_fields = sql.SQL("DELETE FROM {} WHERE doc_type = %s AND document_key = ANY(%s)").format(
+                sql.Identifier(field_table))
+            self._insert_fields = sql.SQL(
+                "INSERT INTO {} (document_key, etag, doc_type, alias, value, confidence) VALUES %s "
+                "ON CONFLICT (doc_type, document_key, alias) DO UPDATE "
+                "SET etag = EXCLUDED.etag, value = EXCLUDED.value, confidence = EXCLUDED.confidence").format(
+                sql.Identifier(field_table))
+
+    def _connect(self):
+        if self.pool is not None:
+            self.connection = self.pool.getconn()
+
+    def _disconnect(self):
+        if self.pool is not None:
+            # A connection that dropped is discarded so the next batch gets a fresh one
+            self.pool.putconn(self.connection, close=bool(self.connection.closed))
+            self.connection = None
+
+    def _reconnect(self):
+        if self.pool is None:
+            return False
+        self.pool.putconn(self.connection, close=True)
+        self.connection = self.pool.getconn()
+        return True
+
+    def _write_rows(self, entries):
+        with self.connection.cursor() as cursor:
+            execute_values(cursor, self._insert, [row for row, _ in entries], page_size=self.batch_size)
+            if self.field_table:
+                cursor.execute(self._delete_fields, (self.table, [row[0] for row, fields in entries if fields is not None]))
+                execute_values(cursor, self._insert_fields, self._field_rows(entries), page_size=self.batch_size * 20)
+        self.connection.commit()
+
+    def prepare(self, aliases=()):
+        self._connect()
+        try:
+            ensure_result_key(self.connection, self.table)
+            if self.field_table:
+                ensure_field_table(self.connection, self.table, aliases, self.field_table)
+        finally:
+            self._disconnect()
+
+    def unprocessed(self, keys, etags):
+        self._connect()
+        try:
+            return ProcessedKeys(self.connection, self.table).unprocessed(keys, etags)
+        finally:
+            self._disconnect()
+
+    def refresh_views(self):
+        self._connect()
+        try:
+            refresh_wide_view(self.connection, self.table)
+        finally:
+            self._disconnect()
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+class SQLiteResultSink(BatchedResultSink):
+    """Result sink writing to a local SQLite file, for runs and benchmarks without a database server
+
+    The write connection is opened in WAL mode by the first flush, so behind
+    BackgroundResultWriter it is created and used only on the writer thread.
+    prepare() and unprocessed() run on the caller's thread with a short-lived
+    connection of their own. The per-field view is a plain view (SQLite has no
+    materialized views), so refresh_views has nothing to do.
+    """
+
+    def __init__(self, path, table, columns=RESULT_COLUMNS, batch_size=BATCH_SIZE, flush_seconds=FLUSH_SECONDS,
+                 conflict_columns=RESULT_KEY, field_table=None):
+        super().__init__(table, columns, batch_size, flush_seconds, conflict_columns, field_table)
+        self.path = path
+        self._insert = (f"INSERT INTO {_quote(table)} ({', '.join(map(_quote, self.columns))}) "
+                        f"VALUES ({', '.join('?' for _ in self.columns)})")
+        if self.conflict_columns:
+            updates = [f"{_quote(column)} = excluded.{_quote(column)}"
+                       for column in self.columns if column not in self.conflict_columns]
+            self._insert += f" ON CONFLICT ({', '.join(map(_quote, self.conflict_columns))}) DO UPDATE SET {', '.join(updates)}"
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            # With WAL, NORMAL only syncs at checkpoints; a crash can lose the last commits but not corrupt the file
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+
+    def _write_rows(self, entries):
+        self.connection.executemany(self._insert, [row for row, _ in entries])
+        if self.field_table:
+            self.connection.executemany(
+                f"DELETE FROM {_quote(self.field_table)} WHERE doc_type = ? AND document_key = ?",
+                [(self.table, row[0]) for row, fields in entries if fields is not None])
+            self.connection.executemany(
+                f"INSERT INTO {_quote(self.field_table)} (document_key, etag, doc_type, alias, value, confidence) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (doc_type, document_key, alias) DO UPDATE "
+                "SET etag = excluded.etag, value = excluded.value, confidence = excluded.confidence",
+                self._field_rows(entries))
+        self.connection.commit()
+
+    def prepare(self, aliases=()):
+        unique = f", UNIQUE ({', '.join(map(_quote, self.conflict_columns))})" if self.conflict_columns else ""
+        statements = [f"CREATE TABLE IF NOT EXISTS {_quote(self.table)} ({', '.join(map(_quote, self.columns))}{unique})"]
+        if self.field_table:
+            view = _quote(f"{self.table}_fields")
+            pivot = "".join(f", max(CASE WHEN alias = {_literal(alias)} THEN value END) AS {_quote(alias)}"
+                            for alias in aliases)
+            statements += [
+                f"""CREATE TABLE IF NOT EXISTS {_quote(self.field_table)} (
+                    document_key TEXT NOT NULL, etag TEXT NOT NULL DEFAULT '', doc_type TEXT NOT NULL,
+                    alias TEXT NOT NULL, value TEXT, confidence REAL,
+                    PRIMARY KEY (doc_type, document_key, alias))""",
+                f"CREATE INDEX IF NOT EXISTS {_quote(self.field_table + '_alias_value_idx')} "
+                f"ON {_quote(self.field_table)} (alias, value)",
+                f"DROP VIEW IF EXISTS {view}",
+                f"CREATE VIEW {view} AS SELECT document_key, etag{pivot} "
+                f"FROM {_quote(self.field_table)} WHERE doc_type = {_literal(self.table)} "
+                "GROUP BY document_key, etag",
+            ]
+        with closing(sqlite3.connect(self.path)) as connection:
+            for statement in statements:
+                connection.execute(statement)
+            connection.commit()
+
+    def unprocessed(self, keys, etags):
+        with closing(sqlite3.connect(self.path)) as connection:
+            stored = set(connection.execute(f"SELECT document_key, etag FROM {_quote(self.table)}"))
+        return [key for key in keys if (key, etags[key]) not in stored]
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,109 @@
+from collections import defaultdict
+
+
+def bounding_box(block):
+    """Return (left, top, right, bottom) for a Textract block, or None if it has no geometry"""
+    bbox = block.get('Geometry', {}).get('BoundingBox')
+    if not bbox:
+        return None
+    left = bbox.get('Left', 0)
+    top = bbox.get('Top', 0)
+    return (left, top, left + bbox.get('Width', 0), top + bbox.get('Height', 0))
+
+
+class BlockIndex:
+    """Uniform grid over the bounding boxes of one page's blocks
+
+    Textract coordinates are normalized to the page (0 to 1), so a fixed cell size
+    works for every page. Each block is stored in every cell its box overlaps, and
+    a lookup only visits the cells under the query rectangle.
+    """
+
+    def __init__(self, blocks, cell_size=0.05, block_types=("LINE", "WORD")):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        self.boxes = {}
+
+        for block in blocks:
+            if block_types and block.get('BlockType') not in block_types:
+                continue
+            box = bounding_box(block)
+            if box is None:
+                continue
+            self.boxes[block['Id']] = (box, block)
+            for cell in self._cells_for(box):
+                self.cells[cell].append(block['Id'])
+
+    def _cell_range(self, low, high):
+        first = max(int(low / self.cell_size), 0)
+        last = max(int(high / self.cell_size), first)
+        return range(first, last + 1)
+
+    def _cells_for(self, box):
+        left, top, right, bottom = box
+        for column in self._cell_range(left, right):
+            for row in self._cell_range(top, bottom):
+                yield (column, row)
+
+    def query(self, left, top, right, bottom, block_type=None):
+        """Return the blocks whose boxes intersect the rectangle, in reading order"""
+        seen = set()
+        found = []
+        for cell in self._cells_for((left, top, right, bottom)):
+            for block_id in self.cells.get(cell, ()):
+                if block_id in seen:
+                    continue
+                seen.add(block_id)
+                box, block = self.boxes[block_id]
+                if block_type and block.get('BlockType') != block_type:
+                    continue
+                if box[0] <= right and box[2] >= left and box[1] <= bottom and box[3] >= top:
+                    found.append((box[1], box[0], block))
+        found.sort(key=lambda item: (item[0], item[1]))
+        return [block for _, _, block in found]
+
+    def right_of(self, label_block, max_distance=0.4, block_type="LINE"):
+        """Return blocks on the same line to the right of label_block, nearest first"""
+        label_box = bounding_box(label_block)
+        if label_box is None:
+            return []
+        left, top, right, bottom = label_box
+        candidates = []
+        for block in self.query(right, top, right + max_distance, bottom, block_type):
+            box = bounding_box(block)
+            if block['Id'] == label_block['Id'] or box[0] < right:
+                continue
+            candidates.append((box[0] - right, block))
+        candidates.sort(key=lambda item: item[0])
+        return [block for _, block in candidates]
+
+    def below(self, label_block, max_distance=0.05, block_type="LINE"):
+        """Return blocks under label_block that overlap it horizontally, nearest first"""
+        label_box = bounding_box(label_block)
+        if label_box is None:
+            return []
+        left, top, right, bottom = label_box
+        candidates = []
+        for block in self.query(left, bottom, right, bottom + max_distance, block_type):
+            box = bounding_box(block)
+            if block['Id'] == label_block['Id'] or box[1] < bottom:
+                continue
+            candidates.append((box[1] - bottom, block))
+        candidates.sort(key=lambda item: item[0])
+        return [block for _, block in candidates]
+
+    def find_value(self, label_block, max_right=0.4, max_below=0.05, block_type="LINE"):
+        """Return the nearest block to the right of a label, else the nearest one below it"""
+        for block in self.right_of(label_block, max_right, block_type):
+            return block
+        for block in self.below(label_block, max_below, block_type):
+            return block
+        return None
+
+
+def build_page_indexes(blocks, **kwargs):
+    """Build one BlockIndex per page; synchronous responses have no Page field and count as page 1"""
+    pages = defaultdict(list)
+    for block in blocks:
+        pages[block.get('Page', 1)].append(block)
+    return {page: BlockIndex(page_blocks, **kwargs) for page, page_blocks in pages.items()}
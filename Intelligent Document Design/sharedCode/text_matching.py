@@ -0,0 +1,113 @@
+import re
+
+try:
+    import ahocorasick
+except ImportError:  # every keyword is then looked for with its own substring search
+    ahocorasick = None
+
+
+# Below this many keywords, one C substring search per keyword beats walking an automaton
+AUTOMATON_MIN_KEYWORDS = 32
+
+
+class KeywordSet:
+    """Fixed list of lowercase keywords to look for in text
+
+    Short lists are checked with one `in` per keyword. From AUTOMATON_MIN_KEYWORDS
+    keywords on, pyahocorasick's Aho-Corasick automaton is used when it is
+    installed, which finds every keyword in one pass however many there are.
+    """
+
+    def __init__(self, keywords, min_automaton_keywords=AUTOMATON_MIN_KEYWORDS):
+        self.keywords = list(keywords)
+        self.automaton = None
+        if ahocorasick is not None and self.keywords and len(self.keywords) >= min_automaton_keywords:
+            self.automaton = ahocorasick.Automaton()
+            for index, keyword in enumerate(self.keywords):
+                self.automaton.add_word(keyword, index)
+            self.automaton.make_automaton()
+
+    def matched(self, text):
+        """Return the set of keyword indexes that occur anywhere in text"""
+        if self.automaton is not None:
+            return {index for _, index in self.automaton.iter(text)}
+        return {index for index, keyword in enumerate(self.keywords) if keyword in text}
+
+    def matched_keywords(self, text):
+        """Return the set of keywords that occur anywhere in text"""
+        return {self.keywords[index] for index in self.matched(text)}
+
+    def contains_any(self, text):
+        """Return True as soon as any keyword is found in text"""
+        if self.automaton is not None:
+            return next(self.automaton.iter(text), None) is not None
+        return any(keyword in text for keyword in self.keywords)
+
+
+class PatternMatcher:
+    """Named regex patterns compiled once and run in the order given
+
+    Each pattern is given as (name, regex) and searches the text on its own: one
+    alternation would hide a match that overlaps an earlier pattern's match.
+    first_matches() stops each search at its first match instead of finding all.
+    """
+
+    def __init__(self, patterns, flags=re.IGNORECASE):
+        self.patterns = [(name, re.compile(regex, flags)) for name, regex in patterns]
+
+    @staticmethod
+    def _match_value(match):
+        return (match.group(1) or "") if match.re.groups else match.group(0)
+
+    def first_matches(self, text):
+        """Return {name: value} with the first match of every pattern that matched"""
+        results = {}
+        for name, compiled in self.patterns:
+            if name in results:
+                continue
+            match = compiled.search(text)
+            if match:
+                results[name] = self._match_value(match)
+        return results
+
+    def iter_matches(self, text):
+        """Yield (name, value) for every match, pattern by pattern in the order given"""
+        for name, compiled in self.patterns:
+            for match in compiled.finditer(text):
+                yield name, self._match_value(match)
+
+
+class KeywordScorer:
+    """Scores several keyword categories against a text with one KeywordSet of all their keywords
+
+    The score for a category is the number of its distinct keywords that appear in
+    the text, the same as sum(1 for kw in keywords if kw in text) per category. A
+    keyword shared by several categories is only looked for once.
+    """
+
+    def __init__(self, categories):
+        self.categories = list(categories)
+        keyword_categories = {}
+        for category, keywords in categories.items():
+            for keyword in keywords:
+                owners = keyword_categories.setdefault(keyword.lower(), [])
+                if category not in owners:
+                    owners.append(category)
+        self.keywords = KeywordSet(keyword_categories)
+        self.keyword_categories = [keyword_categories[keyword] for keyword in self.keywords.keywords]
+
+    def matched(self, text):
+        """Return the set of keyword indexes found in text, for scoring text that arrives in pieces"""
+        return self.keywords.matched(text.lower())
+
+    def scores_for(self, keyword_indexes):
+        """Return {category: score} for a set of keyword indexes from matched()"""
+        scores = dict.fromkeys(self.categories, 0)
+        for keyword_index in keyword_indexes:
+            for category in self.keyword_categories[keyword_index]:
+                scores[category] += 1
+        return scores
+
+    def score(self, text):
+        """Return {category: score} for every category, case-insensitively"""
+        return self.scores_for(self.matched(text))
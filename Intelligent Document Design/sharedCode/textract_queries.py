@@ -0,0 +1,235 @@
+"""Textract query sets used by the finalcodes scripts, one list of analyze arguments per script
+
+Each entry in a list is one request (Textract allows 15 queries per synchronous
+request). Result fields are stored under the query Alias, so aliases must be unique
+within a script.
+"""
+
+# BreastPump.py
+BREAST_PUMP_REQUESTS = [
+    dict(
+        FeatureTypes=["QUERIES", "SIGNATURES"],
+        QueriesConfig={"Queries": [
+        {"Text": "What is the Mother Name?", "Alias": "MOTHER_NAME"},
+        {"Text": "What is the Patient Name?", "Alias": "PATIENT_NAME"},
+        {"Text": "What is the Patient Phone Number?", "Alias": "PHONE_NUMBER"},
+        {"Text": "What is the Patient Date of Birth?", "Alias": "DOB"},
+        {"Text": "What is the Physician Name?", "Alias": "DOCTOR_NAME"},
+        {"Text": "What is the NPI Number?", "Alias": "NPI"},
+        {"Text": "What is the Medical Necessity?", "Alias": "MEDICAL_NEED"},
+        {"Text": "What is the Infant Name?", "Alias": "INFANT_NAME"},
+        {"Text": "What is the Infant Date of Birth?", "Alias": "INFANT_DOB"}
+        ]}
+    )
+]
+
+
+# Facesheet.py
+FACESHEET_REQUESTS = [
+    dict(
+        FeatureTypes=["QUERIES"],
+        QueriesConfig={"Queries": [
+        {"Text": "What is the Patient Name?", "Alias": "patientname"},
+        {"Text": "What is the Patient Date of Birth?", "Alias": "patientdob"},
+        {"Text": "What is the Patient Address?", "Alias": "patientaddress"},
+        {"Text": "What is the Patient sex?", "Alias": "patientsex"},
+        {"Text": "What is the Patient Ethnicity?", "Alias": "patientethnicity"},
+        {"Text": "What is the Patient citizenship?", "Alias": "patientcitizenship"},
+        {"Text": "What is the Patient Race?", "Alias": "patientrace"},
+        {"Text": "What is the Patient Phone Number?", "Alias": "patientphone"},
+        {"Text": "What is the Admitting Provider Name?", "Alias": "admittingname"},
+        {"Text": "What is the Attending Provider Telephone Number?", "Alias": "attendphone"},
+        {"Text": "What is the Attending Provider Name?", "Alias": "attendname"},
+        {"Text": "What is the Refering physician?", "Alias": "refphysician"},
+        {"Text": "What is the admitting diagnosis?", "Alias": "admittingdiagnosis"},
+        {"Text": "What is the Encounter Date?", "Alias": "encounterdate"},
+        {"Text": "What is the MRN?", "Alias": "mrn"}
+        ]}
+    ),
+    dict(
+        FeatureTypes=["QUERIES"],
+        QueriesConfig={"Queries": [
+        {"Text": "What is the Hospital Account number?", "Alias": "hospitalaccountnumber"},
+        {"Text": "What is the Contact Serial number?", "Alias": "contactserialnumber"},
+        {"Text": "What is the Patient insurance provider?", "Alias": "patientinsuranceprovider"},
+        {"Text": "What is the insurance Subscriber name?", "Alias": "insurancesubscribername"},
+        {"Text": "What is the Patient insurance group number?", "Alias": "patientinsurancegroupnumber"},
+        {"Text": "What is the Patient insurance Subscriber Id?", "Alias": "patientinsurancesubscriberid"},
+        {"Text": "What is the Patient insurance type?", "Alias": "patientinsurancetype"},
+        {"Text": "What is the Patient insurance plan?", "Alias": "patientinsuranceplan"},
+        {"Text": "What is the Patient relationship to insurance Subscriber?", "Alias": "patientrelationshiptoinsurancesubscriber"},
+        {"Text": "What is the insurance verifiaction status?", "Alias": "insuranceverificationstatus"},
+        {"Text": "What is the Garuntor Name?", "Alias": "garuntorname"},
+        {"Text": "What is the Garuntor relation to patient?", "Alias": "garuntorrelationtopatient"},
+        {"Text": "What is the Garuntor Id?", "Alias": "garuntorid"},
+        {"Text": "What is the Garuntor Address?", "Alias": "garuntoraddress"},
+        {"Text": "What is the Garuntor Phone number?", "Alias": "garuntorphone"}
+        ]}
+    )
+]
+
+
+# InsuranceCard1.py
+INSURANCE_CARD1_REQUESTS = [
+    dict(
+        FeatureTypes=["QUERIES"],
+        QueriesConfig={"Queries": [
+        {"Text": "What is the Member Name", "Alias": "MEMBER_NAME"},
+        {"Text": "What is the Member ID?", "Alias": "MEMBER_ID"},
+        {"Text": "Who is the PCP?", "Alias": "PCP"},
+        {"Text": "What is the phone number of the PCP?", "Alias": "PCP_PHONE"},
+        {"Text": "What is the medical insurance provider?", "Alias": "MEDICAL_PROVIDER"},
+        {"Text": "What is the effective date?", "Alias": "EFFECTIVE_DATE"},
+        {"Text": "What is the Group No.?", "Alias": "GROUP_NUMBER"},
+        {"Text": "What is the plan type?", "Alias": "PLAN_TYPE"},
+        {"Text": "What is the BIN?", "Alias": "BIN"},
+        {"Text": "What is the Rx PCN?", "Alias": "RX-PCN"},
+        {"Text": "What is the Generic Copay?", "Alias": "GENERIC_COPAY"},
+        {"Text": "What is the Brand Copay?", "Alias": "BRAND_COPAY"},
+        {"Text": "What is the Specialty Copay?", "Alias": "SPECIALTY_COPAY"},
+        {"Text": "What is the Emergency Room Percentage?", "Alias": "EMERGENCY_ROOM_PERCENTAGE"},
+        {"Text": "What is the PCP Copay?", "Alias": "PCP_COPAY"}
+        ]}
+    )
+]
+
+
+# Prescription1.py
+PRESCRIPTION1_REQUESTS = [
+    dict(
+        FeatureTypes=["QUERIES"],
+        QueriesConfig={"Queries": [
+        {"Text": "What is the Member Name", "Alias": "MEMBER_NAME"},
+            {"Text": "What is the Memeber Sex?", "Alias": "MEMBER_SEX"},
+            {"Text": "What is the Member DOB?", "Alias": "MEMBER_DOB"},
+            {"Text": "What is the Member Phone?", "Alias": "MEMBER_PHONE"},
+            {"Text": "What is the Member Age?", "Alias": "MEMBER_AGE"},
+            {"Text": "What is the Member ID?", "Alias": "MEMBER_ID"},
+            {"Text": "Who is the Presciber?", "Alias": "PRESCRIBER"},
+            {"Text": "What is the phone number of the PCP?", "Alias": "PCP_PHONE"},
+            {"Text": "What is the PCP Fax?", "Alias": "PCP_FAX"},
+            {"Text": "What is the medical insurance provider?", "Alias": "MEDICAL_PROVIDER"},
+            {"Text": "What is the Group Name?", "Alias": "GROUP_NAME"},
+            {"Text": "What is the payer id?", "Alias": "PAYER_ID"},
+            {"Text": "What is the Rx GRP?", "Alias": "RX_GRP"},
+            {"Text": "What is the Applicable Diagnosis?", "Alias": "APPLICABLE_DIAGNOSIS"},
+            {"Text": "What is the Supply?", "Alias": "SUPPLY"}
+        ]}
+    ),
+    dict(
+        FeatureTypes=["QUERIES"],
+        QueriesConfig={"Queries": [
+        {"Text": "What is the Supply Quantity?", "Alias": "SUPPLY_QUANTITY"},
+        {"Text": "What is the Supply Duration?", "Alias": "SUPPLY_DURATION"}
+        ]}
+    )
+]
+
+
+# Prescription2.py
+PRESCRIPTION2_REQUESTS = [
+    dict(
+        FeatureTypes=["QUERIES"],
+        QueriesConfig={"Queries": [
+        {"Text": "What is the Member Name?", "Alias": "MEMBER_NAME"},
+        {"Text": "What is the Member ID?", "Alias": "MEMBER_ID"},
+        {"Text": "Who is the PCP?", "Alias": "PCP"},
+        {"Text": "What is the phone number of the PCP?", "Alias": "PCP_PHONE"},
+        {"Text": "What is the medical insurance provider?", "Alias": "MEDICAL_PROVIDER"},
+        {"Text": "What is the effective date?", "Alias": "EFFECTIVE_DATE"},
+        {"Text": "What is the Group Name?", "Alias": "GROUP_NAME"},
+        {"Text": "What is the payer id?", "Alias": "PAYER_ID"},
+        {"Text": "What is the RS BIN?", "Alias": "RX_BIN"},
+        {"Text": "What is the Rx PCN?", "Alias": "RX_PCN"},
+        {"Text": "What is the Rx GRP?", "Alias": "RX_GRP"}
+        ]}
+    )
+]
+
+
+# InsuranceCard2.py asks the same questions as Prescription2.py, but stores them in its own table
+INSURANCE_CARD2_REQUESTS = PRESCRIPTION2_REQUESTS
+
+# SignedAgreement.py reads FORMS key-values and signatures, no queries
+SIGNED_AGREEMENT_REQUESTS = [
+    dict(FeatureTypes=["FORMS", "SIGNATURES"])
+]
+
+# MiscTestingScripts/Ethan_PDFandJPG3.py
+DOCUMENT_ANALYSIS_REQUESTS = [
+    dict(FeatureTypes=["FORMS", "TABLES", "SIGNATURES"])
+]
+
+# Which query set produced the rows of each result table
+TABLE_REQUESTS = {
+    "breastpump": BREAST_PUMP_REQUESTS,
+    "facesheet": FACESHEET_REQUESTS,
+    "insurance1": INSURANCE_CARD1_REQUESTS,
+    "insurance2": INSURANCE_CARD2_REQUESTS,
+    "prescription1": PRESCRIPTION1_REQUESTS,
+    "prescription2": PRESCRIPTION2_REQUESTS,
+}
+
+
+def question_key(question):
+    """The key the scripts used to store an answer under before aliases: "What is the Member ID?" -> "Member ID"""
+    return question.split("the ", 1)[1].split("?", 1)[0]
+
+
+def query_aliases(requests):
+    """Every query alias of a query set, in request order"""
+    return [
+        query["Alias"]
+        for request in requests
+        for query in request.get("QueriesConfig", {}).get("Queries", [])
+    ]
+
+
+def query_answers(response):
+    """[(question, alias, answer text)] for each query on the first page, like trp2's get_query_answers
+
+    Reads the QUERY and QUERY_RESULT blocks directly instead of loading the whole
+    response into trp2 objects, which costs far more than the lookup itself. A query
+    without an answer gives "", and one with several answers gives a row per answer.
+    """
+    blocks = {block["Id"]: block for block in response.get("Blocks", [])}
+    pages = [block.get("Page", 1) for block in blocks.values() if block["BlockType"] == "PAGE"]
+    first_page = min(pages, default=1)
+    answers = []
+    for block in blocks.values():
+        if block["BlockType"] != "QUERY" or block.get("Page", 1) != first_page:
+            continue
+        answer_ids = [answer_id
+                      for relationship in block.get("Relationships", []) if relationship["Type"] == "ANSWER"
+                      for answer_id in relationship["Ids"]]
+        for answer_id in answer_ids:
+            answers.append((block["Query"]["Text"], block["Query"].get("Alias"), blocks[answer_id].get("Text", "")))
+        if not answer_ids:
+            answers.append((block["Query"]["Text"], block["Query"].get("Alias"), ""))
+    return answers
+
+
+def query_confidences(response):
+    """{alias: confidence from 0 to 1} of each answered query in an analyze response"""
+    blocks = {block["Id"]: block for block in response.get("Blocks", [])}
+    confidences = {}
+    for block in blocks.values():
+        if block["BlockType"] != "QUERY":
+            continue
+        for relationship in block.get("Relationships", []):
+            if relationship["Type"] != "ANSWER":
+                continue
+            for answer_id in relationship["Ids"]:
+                answer = blocks.get(answer_id)
+                if answer is not None:
+                    confidences[block["Query"]["Alias"]] = answer["Confidence"] / 100
+    return confidences
+
+
+def alias_map(requests):
+    """{old question key: alias} for every query in a query set"""
+    return {
+        question_key(query["Text"]): query["Alias"]
+        for request in requests
+        for query in request.get("QueriesConfig", {}).get("Queries", [])
+    }